@@ -2,12 +2,14 @@
 Upload a foldcomp database to the hub.
 """
 import argparse
+import importlib.util
 import io
 import itertools
 import os
-from typing import Optional
+from typing import List, Optional, Union
 
 import foldcomp
+from huggingface_hub import constants as hf_constants
 
 from bio_datasets import Dataset, Features, NamedSplit, Value
 from bio_datasets.features import ProteinAtomArrayFeature, ProteinStructureFeature
@@ -15,14 +17,23 @@ from bio_datasets.features.atom_array import load_structure
 from bio_datasets.structure import ProteinChain
 
 
-def examples_generator(
-    db_file, max_examples: Optional[int] = None, as_array: bool = False
-):
+def read_db_names(db_file, max_examples: Optional[int] = None):
+    """Read entry names from the foldcomp db lookup file (`key\tname\tdbtype` per line)."""
+    with open(db_file + ".lookup") as f:
+        return [
+            line.rstrip("\n").split("\t")[1]
+            for line in itertools.islice(f, max_examples)
+        ]
+
+
+def examples_generator(db_file, names: List[str], as_array: bool = False):
+    """Yield examples for the given entries; datasets splits `names` across num_proc jobs."""
     assert os.path.exists(db_file)
-    with foldcomp.open(db_file, decompress=True) as db:
-        for (name, pdb_str) in itertools.islice(db, max_examples):
-            # if we opened with decompress False, we wouldn't get name
-            if as_array:
+    with foldcomp.open(
+        db_file, ids=names, decompress=as_array, err_on_missing=True
+    ) as db:
+        if as_array:
+            for (name, pdb_str) in db:
                 atoms = load_structure(
                     io.StringIO(pdb_str), file_type="pdb", extra_fields=["b_factor"]
                 )
@@ -32,16 +43,28 @@ def examples_generator(
                     # "structure": ProteinChain(atoms), TODO: profile why this is slower
                 }
                 yield example
-            else:
-                pdb_bytes = foldcomp.compress(name, pdb_str)
-                # pdb_bytes = bytes(pdb_str)
+        else:
+            # raw fcz records don't carry names, but iteration follows ids order
+            for name, fcz_bytes in zip(names, db):
                 example = {
                     "name": name,
-                    "structure": {"bytes": pdb_bytes, "path": None, "type": "fcz"},
+                    "structure": {"bytes": fcz_bytes, "path": None, "type": "fcz"},
                 }
                 yield example
 
 
+def enable_concurrent_uploads():
+    """Upload each parquet shard as concurrent multipart chunks if hf_transfer is installed.
+
+    Large foldcomp databases are bandwidth-bound on push, and a single stream per shard
+    doesn't saturate the connection.
+    """
+    if importlib.util.find_spec("hf_transfer") is not None:
+        hf_constants.HF_HUB_ENABLE_HF_TRANSFER = True
+    else:
+        print("hf_transfer not installed: shards will be uploaded over a single stream")
+
+
 def main(
     repo_id: str,
     db_file: str,
@@ -50,6 +73,10 @@ def main(
     max_examples: Optional[int] = None,
     backbone_only: bool = False,
     tmp_dir: Optional[str] = None,
+    num_shards: Optional[int] = None,
+    max_shard_size: Optional[Union[str, int]] = None,
+    num_proc: Optional[int] = None,
+    writer_batch_size: Optional[int] = None,
 ):
     # from_generator calls GeneratorBasedBuilder.download_and_prepare and as_dataset
     features = Features(
@@ -62,19 +89,27 @@ def main(
     )
     import tempfile
 
-    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as temp_dir:
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as temp_dir:
         ds = Dataset.from_generator(
             examples_generator,
             gen_kwargs={
                 "db_file": db_file,
-                "max_examples": max_examples,
+                "names": read_db_names(db_file, max_examples),
                 "as_array": as_array,
             },
+            num_proc=num_proc,
+            writer_batch_size=writer_batch_size,
             features=features,
             cache_dir=temp_dir,
             split=NamedSplit("train"),
         )
-        ds.push_to_hub(repo_id, config_name=config_name or "default")
+        enable_concurrent_uploads()
+        ds.push_to_hub(
+            repo_id,
+            config_name=config_name or "default",
+            num_shards=num_shards,
+            max_shard_size=max_shard_size,
+        )
 
 
 if __name__ == "__main__":
@@ -89,6 +124,10 @@ if __name__ == "__main__":
     parser.add_argument(
         "--tmp_dir", type=str, default=None
     )  # use a usb drive for large datasets (caching)
+    parser.add_argument("--num_shards", type=int, default=None)
+    parser.add_argument("--max_shard_size", type=str, default=None)
+    parser.add_argument("--num_proc", type=int, default=None)
+    parser.add_argument("--writer_batch_size", type=int, default=None)
     args = parser.parse_args()
     if args.foldcomp_db_name is None and args.foldcomp_db_path is None:
         raise ValueError("Either foldcomp_db_name or foldcomp_db_path must be provided")
@@ -109,4 +148,8 @@ if __name__ == "__main__":
         max_examples=args.max_examples,
         backbone_only=args.backbone_only,
         tmp_dir=args.tmp_dir,
+        num_shards=args.num_shards,
+        max_shard_size=args.max_shard_size,
+        num_proc=args.num_proc,
+        writer_batch_size=args.writer_batch_size,
     )
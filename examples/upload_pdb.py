@@ -11,50 +11,140 @@ And maybe just delete unnecessary blocks...
 https://pdbsnapshots.s3.us-west-2.amazonaws.com/index.html#20240101/pub/pdb/data/structures/divided/mmCIF/
 https://pdbsnapshots.s3.us-west-2.amazonaws.com/index.html#20240101/pub/pdb/data/assemblies/mmCIF/divided/aq/
 """
+
 import argparse
+import collections
+import functools
+import gzip
+import io
+import itertools
 import os
-import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore import UNSIGNED
+from botocore.config import Config
 
 from bio_datasets import Dataset, Features, NamedSplit, Value
 from bio_datasets.features import AtomArrayFeature, StructureFeature
+from bio_datasets.structure.parsing import cif_to_bcif
+
+PDB_BUCKET = "pdbsnapshots"
+ASSEMBLIES_PREFIX = "20240101/pub/pdb/data/assemblies/mmCIF/divided"
+# large files are fetched as parallel byte-range requests
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=16,
+    use_threads=True,
+)
 
 
 def get_pdb_id(assembly_file):
     return assembly_file.split("-")[0]
 
 
-def examples_generator(pair_codes):
+def make_s3_client():
+    # pdbsnapshots is a public bucket, so requests don't need to be signed
+    return boto3.session.Session().client(
+        "s3",
+        config=Config(
+            signature_version=UNSIGNED,
+            max_pool_connections=128,
+            retries={"max_attempts": 10, "mode": "adaptive"},
+        ),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_s3_client(pid: int):
+    return make_s3_client()
+
+
+def get_s3_client():
+    """Shared client (and connection pool) for the current process.
+
+    Keyed on pid because boto3 sessions and clients are not safe to share across forks.
+    """
+    return _get_s3_client(os.getpid())
+
+
+def list_pair_codes(s3):
+    paginator = s3.get_paginator("list_objects_v2")
+    return [
+        common_prefix["Prefix"].rstrip("/").split("/")[-1]
+        for page in paginator.paginate(
+            Bucket=PDB_BUCKET, Prefix=f"{ASSEMBLIES_PREFIX}/", Delimiter="/"
+        )
+        for common_prefix in page.get("CommonPrefixes", [])
+    ]
+
+
+def list_pair_code_keys(s3, pair_code):
+    paginator = s3.get_paginator("list_objects_v2")
+    return [
+        obj["Key"]
+        for page in paginator.paginate(
+            Bucket=PDB_BUCKET, Prefix=f"{ASSEMBLIES_PREFIX}/{pair_code}/"
+        )
+        for obj in page.get("Contents", [])
+    ]
+
+
+def fetch_assembly(s3, key, as_bcif: bool = False):
+    """Fetch a single assembly file into memory.
+
+    Returns (file_name, structure), where structure is the example's structure dict
+    holding the (decompressed) mmCIF contents, or BinaryCIF contents if as_bcif.
+    """
+    buffer = io.BytesIO()
+    s3.download_fileobj(PDB_BUCKET, key, buffer, Config=TRANSFER_CONFIG)
+    file_name, contents = os.path.basename(key), buffer.getvalue()
+    if file_name.endswith(".gz"):
+        file_name, contents = file_name[:-3], gzip.decompress(contents)
+    if as_bcif:
+        bcif_name = file_name.split(".cif")[0] + ".bcif"
+        return file_name, {
+            "bytes": cif_to_bcif(contents),
+            "path": bcif_name,
+            "type": "bcif",
+        }
+    return file_name, {"bytes": contents, "path": file_name, "type": "cif"}
+
+
+def examples_generator(
+    pair_codes,
+    max_workers: int = 64,
+    max_in_flight: int = 256,
+    as_bcif: bool = False,
+):
+    """Yield assemblies for each pair code, in listing order.
+
+    Up to `max_in_flight` assemblies (across pair code boundaries) are fetched and
+    converted in memory in the background while earlier examples are being written.
+    """
+    s3 = get_s3_client()
     if pair_codes is None:
-        raise NotImplementedError("No pair codes provided")
-    else:
-        for pair_code in pair_codes:
-            os.makedirs(f"data/pdb/{pair_code}", exist_ok=True)
-            # download from s3
-            # TODO use boto3
-            subprocess.run(
-                [
-                    "aws",
-                    "s3",
-                    "cp",
-                    "--recursive",
-                    "--no-sign-request",
-                    f"s3://pdbsnapshots/20240101/pub/pdb/data/assemblies/mmCIF/divided/{pair_code}",
-                    f"data/pdb/{pair_code}",
-                ],
-                check=True,
-            )
-
-            downloaded_assemblies = os.listdir(f"data/pdb/{pair_code}")
-            for assembly_file in downloaded_assemblies:
-                # TODO: add extra metadata perhaps?
-                yield {
-                    "id": get_pdb_id(assembly_file),
-                    "structure": {
-                        "path": f"data/pdb/{pair_code}/{assembly_file}",
-                        "type": "cif",
-                    },
-                }
+        pair_codes = list_pair_codes(s3)
+    keys = (
+        key for pair_code in pair_codes for key in list_pair_code_keys(s3, pair_code)
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = collections.deque(
+            executor.submit(fetch_assembly, s3, key, as_bcif)
+            for key in itertools.islice(keys, max_in_flight)
+        )
+        while pending:
+            file_name, structure = pending.popleft().result()
+            for key in itertools.islice(keys, 1):
+                pending.append(executor.submit(fetch_assembly, s3, key, as_bcif))
+            # TODO: add extra metadata perhaps?
+            yield {
+                "id": get_pdb_id(file_name),
+                "structure": structure,
+            }
 
 
 def main(args):
@@ -63,15 +153,23 @@ def main(args):
         structure=AtomArrayFeature() if args.as_array else StructureFeature(),
     )
 
-    with tempfile.TemporaryDirectory() as temp_dir:
+    pair_codes = args.pair_codes
+    if pair_codes is None and args.num_proc is not None:
+        # pair codes need to be listed up front to be sharded across processes
+        pair_codes = list_pair_codes(get_s3_client())
+
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as temp_dir:
         ds = Dataset.from_generator(
             examples_generator,
             gen_kwargs={
-                "pair_codes": args.pair_codes,
+                "pair_codes": pair_codes,
+                "as_bcif": args.as_bcif,
             },
             features=features,
             cache_dir=temp_dir,
             split=NamedSplit("train"),
+            num_proc=args.num_proc,
+            writer_batch_size=args.writer_batch_size,
         )
         ds.push_to_hub("biodatasets/pdb", config_name=args.config_name or "default")
 
@@ -80,7 +178,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--config_name", type=str, default=None)
     parser.add_argument(
-        "--pair_codes", nargs="+", help="PDB 2-letter codes", default=None
+        "--pair_codes",
+        nargs="+",
+        help="PDB 2-letter codes (defaults to all codes in the snapshot)",
+        default=None,
     )
     parser.add_argument(
         "--backbone_only", action="store_true", help="Whether to drop sidechains"
@@ -88,6 +189,16 @@ if __name__ == "__main__":
     parser.add_argument(
         "--as_array", action="store_true", help="Whether to return an array"
     )
+    parser.add_argument(
+        "--as_bcif",
+        action="store_true",
+        help="Whether to convert assemblies to BinaryCIF before upload",
+    )
+    parser.add_argument(
+        "--tmp_dir", type=str, default=None
+    )  # use a fast scratch disk for large datasets (caching)
+    parser.add_argument("--num_proc", type=int, default=None)
+    parser.add_argument("--writer_batch_size", type=int, default=None)
     args = parser.parse_args()
 
     main(args)
@@ -13,13 +13,19 @@ N.B. we recommend downloading the entire dataset first - using cloud downloads o
 basis is slow and not robust.
 """
 import argparse
+import collections
 import contextlib
+import functools
 import io
+import itertools
 import logging
 import math
 import os
 import pathlib
+import sys
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Tuple
 
 import biotite.sequence.align as align
@@ -96,9 +102,17 @@ def import_pinder(override_gsutil: bool = False):
 
     pinder.core.utils.cloud.Gsutil = Gsutil
 
+    import pinder.core.structure.atoms
+
+    # holo, apo and predicted structures of a system share sequences, so memoise the
+    # alignment DP (align_sequences looks get_seq_alignments up as a module global)
+    pinder.core.structure.atoms.get_seq_alignments = functools.lru_cache(maxsize=4096)(
+        pinder.core.structure.atoms.get_seq_alignments
+    )
+
     global PinderSystem, get_index, get_metadata, IndexEntry, Structure
     global _align_and_map_sequences, _get_seq_aligned_structures, _get_structure_and_res_info
-    global apply_mask, get_seq_alignments, mask_from_res_list
+    global apply_mask, get_seq_alignments
 
     from pinder.core import PinderSystem, get_index, get_metadata
     from pinder.core.index.utils import IndexEntry
@@ -109,7 +123,6 @@ def import_pinder(override_gsutil: bool = False):
         _get_structure_and_res_info,
         apply_mask,
         get_seq_alignments,
-        mask_from_res_list,
     )
 
 
@@ -122,7 +135,7 @@ def mask_structure(structure: Structure, mask: np.ndarray) -> Structure:
         filepath=structure.filepath,
         uniprot_map=structure.uniprot_map,
         pinder_id=structure.pinder_id,
-        atom_array=apply_mask(structure.atom_array.copy(), mask),
+        atom_array=apply_mask(structure.atom_array, mask),
     )
 
 
@@ -174,32 +187,33 @@ def align_sequence_to_ref(
 
     # assigning reference numbering to all residues in a given sequence
     # (e.g. PDB chain)
-    # p = subject protein sequence, u = ref sequence
-    ref_numbering_mapped = []
-    subject_numbering_mapped = []
-    subject_sequence_mapped = ""
-    ref_sequence_mapped = ""
-    ui = -1
-    pj = -1
-    for p, u in zip(s[0], s[1]):
-        if u:
-            ui += 1
-        if p:
-            pj += 1
-        if u:
-            # ref_numbering_mapped.append(ui + 1)  # 1-based
-            ref_numbering_mapped.append(ref_numbering[ui])
-            subject_numbering_mapped.append(subject_numbering[pj])
-            ref_sequence_mapped += u
-            subject_sequence_mapped += p
+    # s[0] = subject protein sequence, s[1] = ref sequence; gaps are -1 in the trace
+    subject_present = aln.trace[:, 0] != -1
+    ref_present = aln.trace[:, 1] != -1
+    # running index into each sequence at every alignment column
+    ui = np.cumsum(ref_present) - 1
+    pj = np.cumsum(subject_present) - 1
+    ref_symbols = np.array(s[1], dtype=object)[ref_present]
+    # subject gaps at ref positions are written as '-'
+    subject_symbols = np.where(subject_present, np.array(s[0], dtype=object), "-")[
+        ref_present
+    ]
     return (
-        ref_sequence_mapped,
-        subject_sequence_mapped,
-        ref_numbering_mapped,
-        subject_numbering_mapped,
+        "".join(ref_symbols),
+        "".join(subject_symbols),
+        np.asarray(ref_numbering)[ui[ref_present]].tolist(),
+        np.asarray(subject_numbering)[pj[ref_present]].tolist(),
     )
 
 
+def residues_by_id(
+    res_ids: np.ndarray, res_names: np.ndarray, query_ids: np.ndarray
+) -> np.ndarray:
+    """Look up the name of the first residue with each of query_ids."""
+    unique_ids, first_index = np.unique(res_ids, return_index=True)
+    return res_names[first_index[np.searchsorted(unique_ids, query_ids)]]
+
+
 def get_subject_positions_in_ref_masks(
     ref_at,
     target_at,
@@ -226,37 +240,53 @@ def get_subject_positions_in_ref_masks(
 
     ref_ids, ref_residues = bs.get_residues(ref_structure)
     subj_ids, subj_residues = bs.get_residues(subj_structure)
-    # identify residues with sequence match
-    subj_resid_seq_match_map = {
-        subj_id: ref_id
-        for subj_id, ref_id in subj_resid_map.items()
-        if subj_residues[list(subj_ids).index(subj_id)]
-        == ref_residues[list(ref_ids).index(ref_id)]
-    }
-
-    subj_resid_mutation_map = {
-        subj_id: ref_id
-        for subj_id, ref_id in subj_resid_map.items()
-        if subj_id not in subj_resid_seq_match_map
-    }
+    mapped_subj_ids = np.fromiter(subj_resid_map.keys(), dtype=int)
+    mapped_ref_ids = np.fromiter(subj_resid_map.values(), dtype=int)
+    # identify residues with sequence match (comparing the first residue with each id)
+    seq_match = residues_by_id(subj_ids, subj_residues, mapped_subj_ids) == (
+        residues_by_id(ref_ids, ref_residues, mapped_ref_ids)
+    )
 
     # uncomment to debug
-    # for subj_id, ref_id in subj_resid_mutation_map.items():
+    # for subj_id, ref_id in zip(mapped_subj_ids[~seq_match], mapped_ref_ids[~seq_match]):
     #     atoms = subj_structure[subj_structure.res_id == subj_id]
     #     ref_atoms = ref_structure[ref_structure.res_id == ref_id]
     #     assert len(atoms) == len(ref_atoms), f"{atoms} != {ref_atoms} {ref_atoms.ins_code}"
 
     # values are positions in ref that subject aligns to and has matching sequence
-    subj_mask_in_ref = mask_from_res_list(
-        ref_structure, list(subj_resid_seq_match_map.values())
-    )
-    subj_mask = mask_from_res_list(
-        subj_structure, list(subj_resid_seq_match_map.keys())
-    )
+    subj_mask_in_ref = np.isin(ref_structure.res_id, mapped_ref_ids[seq_match])
+    subj_mask = np.isin(subj_structure.res_id, mapped_subj_ids[seq_match])
     # TODO: we could include backbone at aligned but non-identical positions
     return subj_mask_in_ref, subj_mask
 
 
+def checked_astype(values: np.ndarray, dtype: str) -> np.ndarray:
+    """Cast integers to a narrower dtype, raising rather than wrapping out-of-range values."""
+    info = np.iinfo(dtype)
+    if values.size and (values.min() < info.min or values.max() > info.max):
+        raise ValueError(
+            f"Values in [{values.min()}, {values.max()}] do not fit in {dtype}"
+        )
+    return values.astype(dtype)
+
+
+def uniprot_mapping_arrays(pdb2uniprot: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert a resid -> uniprot resid mapping to sorted parallel arrays.
+
+    PDB resids can be negative (e.g. expression tags) so are stored as int32;
+    uniprot resids are positive sequence positions, stored as uint16.
+    """
+    res_ids = np.fromiter(pdb2uniprot.keys(), dtype=np.int64, count=len(pdb2uniprot))
+    uniprot_res_ids = np.fromiter(
+        pdb2uniprot.values(), dtype=np.int64, count=len(pdb2uniprot)
+    )
+    order = np.argsort(res_ids)
+    return (
+        checked_astype(res_ids[order], "int32"),
+        checked_astype(uniprot_res_ids[order], "uint16"),
+    )
+
+
 class PinderDataset:
 
     """Class to handle aligning of apo sequences to complex and standardisation of structures.
@@ -273,6 +303,9 @@ class PinderDataset:
     ):
         self.index = index
         self.metadata = metadata
+        # hash lookups by system id rather than scanning the tables per item
+        self._index_by_id = index.set_index("id", drop=False)
+        self._metadata_by_id = metadata.set_index("id", drop=False)
         self.cleanup = cleanup
         self.dataset_path = (
             pathlib.Path(dataset_path) if dataset_path is not None else None
@@ -297,12 +330,15 @@ class PinderDataset:
         assert len(set(target_chains)) == 1
         assert len(set(ref_chains)) == 1
 
-        ref_at = ref_struct.atom_array.copy()
+        # filter_atoms returns a (masked) copy, so the originals aren't modified
         residue_dict = ProteinDictionary.from_preset("protein", keep_oxt=False)
-        ref_at = Biomolecule.filter_atoms(ref_at, residue_dictionary=residue_dict)
+        ref_at = Biomolecule.filter_atoms(
+            ref_struct.atom_array, residue_dictionary=residue_dict
+        )
         ref_at = Biomolecule.standardise_atoms(ref_at, residue_dict)
-        target_at = target_struct.atom_array.copy()
-        target_at = Biomolecule.filter_atoms(target_at, residue_dictionary=residue_dict)
+        target_at = Biomolecule.filter_atoms(
+            target_struct.atom_array, residue_dictionary=residue_dict
+        )
         target_at = Biomolecule.standardise_atoms(target_at, residue_dict)
 
         if mode == "ref":
@@ -315,10 +351,13 @@ class PinderDataset:
             # the below also automatically handles renumbering.
             aligned_target_at = ref_at.copy()
             # We'll assume that the sequence is the same at positions that don't align, so only coords need to be masked
-            aligned_target_at.coord[~subj_mask_in_ref] = np.nan
+            coord = np.full_like(ref_at.coord, np.nan)
+            coord[subj_mask_in_ref] = target_at.coord[subj_mask]
+            aligned_target_at.coord = coord
             if "b_factor" in ref_at._annot:
-                aligned_target_at.b_factor[~subj_mask_in_ref] = np.nan
-            aligned_target_at.coord[subj_mask_in_ref] = target_at[subj_mask].coord
+                aligned_target_at.b_factor = np.where(
+                    subj_mask_in_ref, ref_at.b_factor, np.nan
+                )
             target_at = aligned_target_at
 
         elif mode == "intersection":
@@ -432,10 +471,11 @@ class PinderDataset:
                 mode="ref",
             )
 
-        holo_receptor_at = holo_receptor.atom_array.copy()
-        holo_ligand_at = holo_ligand.atom_array.copy()
-        holo_receptor_at = Biomolecule.filter_atoms(holo_receptor_at, protein_dict)
-        holo_ligand_at = Biomolecule.filter_atoms(holo_ligand_at, protein_dict)
+        # filter_atoms returns a (masked) copy, so the originals aren't modified
+        holo_receptor_at = Biomolecule.filter_atoms(
+            holo_receptor.atom_array, protein_dict
+        )
+        holo_ligand_at = Biomolecule.filter_atoms(holo_ligand.atom_array, protein_dict)
         holo_receptor_at = Biomolecule.standardise_atoms(holo_receptor_at, protein_dict)
         holo_ligand_at = Biomolecule.standardise_atoms(holo_ligand_at, protein_dict)
         holo_receptor = Structure(
@@ -484,15 +524,46 @@ class PinderDataset:
             "holo_ligand": holo_ligand,
         }
 
-    def _get_item_from_id(self, id):
-        row = self.index[self.index["id"] == id].iloc[0]
-        metadata = self.metadata[self.metadata["id"] == id].iloc[0]
+    def _load_system(self, entry: IndexEntry):
         # n.b. PinderSystem will automatically download if entry can't be found locally
-        # TODO: if necessary, renumber reference ids to always be contiguous (before alignment)
         # TODO: check whether paths exist and sleep if not (prevent parsing error due to truncated file download...)
-        system = PinderSystem(
-            entry=IndexEntry(**row.to_dict()), dataset_path=self.dataset_path
-        )
+        return PinderSystem(entry=entry, dataset_path=self.dataset_path)
+
+    def _load_system_quietly(self, entry: IndexEntry):
+        # pinder prints and logs while downloading; silenced as in the serial path
+        with suppress_output():
+            return self._load_system(entry)
+
+    def _entry(self, idx: int) -> IndexEntry:
+        return IndexEntry(**self.index.iloc[idx].to_dict())
+
+    def prefetch_systems(self, num_items: Optional[int] = None, prefetch: int = 4):
+        """Yield futures of the first num_items systems, in order.
+
+        PinderSystem construction downloads and parses structures, so the next `prefetch`
+        systems are loaded in background threads while the current one is processed.
+        """
+        num_items = len(self) if num_items is None else num_items
+        # entries are built as they're submitted, rather than for the whole index up front
+        entries = (self._entry(idx) for idx in range(num_items))
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            pending = collections.deque(
+                executor.submit(self._load_system_quietly, entry)
+                for entry in itertools.islice(entries, prefetch)
+            )
+            while pending:
+                future = pending.popleft()
+                for entry in itertools.islice(entries, 1):
+                    pending.append(executor.submit(self._load_system_quietly, entry))
+                yield future
+
+    def _get_item_from_id(self, id):
+        row = self._index_by_id.loc[id]
+        return self.get_item_from_system(self._load_system(IndexEntry(**row.to_dict())))
+
+    def get_item_from_system(self, system: PinderSystem):
+        metadata = self._metadata_by_id.loc[system.entry.id]
+        # TODO: if necessary, renumber reference ids to always be contiguous (before alignment)
         if system.entry.predicted_R:
             uniprot_seq_R = system.pred_receptor.sequence
         else:
@@ -507,23 +578,14 @@ class PinderDataset:
         holo_receptor = structures.pop("holo_receptor")
         holo_ligand = structures.pop("holo_ligand")
 
-        structures["receptor_resids_with_uniprot_mapping"] = list(
-            sorted(list(holo_receptor.resolved_pdb2uniprot.keys()))
-        )
-        structures["receptor_mapped_uniprot_resids"] = [
-            holo_receptor.resolved_pdb2uniprot[res_id]
-            for res_id in structures["receptor_resids_with_uniprot_mapping"]
-        ]
-        structures["ligand_resids_with_uniprot_mapping"] = list(
-            sorted(list(holo_ligand.resolved_pdb2uniprot.keys()))
-        )
-        structures["ligand_mapped_uniprot_resids"] = np.array(
-            [
-                holo_ligand.resolved_pdb2uniprot[res_id]
-                for res_id in structures["ligand_resids_with_uniprot_mapping"]
-            ],
-            dtype="uint16",
-        )
+        (
+            structures["receptor_resids_with_uniprot_mapping"],
+            structures["receptor_mapped_uniprot_resids"],
+        ) = uniprot_mapping_arrays(holo_receptor.resolved_pdb2uniprot)
+        (
+            structures["ligand_resids_with_uniprot_mapping"],
+            structures["ligand_mapped_uniprot_resids"],
+        ) = uniprot_mapping_arrays(holo_ligand.resolved_pdb2uniprot)
         structures["receptor_uniprot_accession"] = system.entry.uniprot_R
         structures["ligand_uniprot_accession"] = system.entry.uniprot_L
         # TODO: get metadata
@@ -534,7 +596,9 @@ class PinderDataset:
             "cluster_id_R",
             "cluster_id_L",
         ]:
-            structures[key] = row[key]
+            structures[key] = getattr(system.entry, key)
+        # numeric metadata is left to the Value features to cast, since arrow raises on
+        # out-of-range values (and stores None as null) where numpy casts would wrap
         for metadata_key in [
             "method",
             "resolution",
@@ -544,28 +608,43 @@ class PinderDataset:
             "ECOD_names_L",
         ]:
             structures[metadata_key] = metadata[metadata_key]
-        structures["id"] = row["id"]
-        structures["pdb_id"] = row["pdb_id"]
+        structures["id"] = system.entry.id
+        structures["pdb_id"] = system.entry.pdb_id
         return structures
 
     def __getitem__(self, idx):
-        id = self.index.iloc[idx]["id"]
-        return self._get_item_from_id(id)
+        return self.get_item_from_system(self._load_system(self._entry(idx)))
+
+
+_suppress_lock = threading.Lock()
+_suppress_depth = 0
+_suppressed_streams = None
 
 
 @contextlib.contextmanager
 def suppress_output():
-    # Suppress stdout and stderr
-    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
-        io.StringIO()
-    ):
-        # Disable logging temporarily
-        logging.disable(logging.CRITICAL)
-        try:
-            yield
-        finally:
-            # Re-enable logging
-            logging.disable(logging.NOTSET)
+    """Suppress stdout, stderr and logging.
+
+    sys.stdout / sys.stderr are process-wide, so prefetch threads share one redirect:
+    output is restored when the last thread (or nested caller) exits.
+    """
+    global _suppress_depth, _suppressed_streams
+    with _suppress_lock:
+        if _suppress_depth == 0:
+            _suppressed_streams = (sys.stdout, sys.stderr)
+            sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+            # Disable logging temporarily
+            logging.disable(logging.CRITICAL)
+        _suppress_depth += 1
+    try:
+        yield
+    finally:
+        with _suppress_lock:
+            _suppress_depth -= 1
+            if _suppress_depth == 0:
+                sys.stdout, sys.stderr = _suppressed_streams
+                # Re-enable logging
+                logging.disable(logging.NOTSET)
 
 
 def examples_generator(
@@ -580,12 +659,14 @@ def examples_generator(
             index_df, metadata, dataset_path=dataset_path, cleanup=cleanup
         )
         print(f"Dataset length: {len(ds)}")
-        for i in tqdm.tqdm(range(len(ds)), disable=len(index) > 1):
-            if max_examples is not None and i >= max_examples:
-                break
+        num_items = len(ds) if max_examples is None else min(len(ds), max_examples)
+        systems = ds.prefetch_systems(num_items)
+        for i, system in enumerate(
+            tqdm.tqdm(systems, total=num_items, disable=len(index) > 1)
+        ):
             try:
                 with suppress_output():
-                    ex = ds[i]
+                    ex = ds.get_item_from_system(system.result())
             except Exception as e:
                 print(f"Error getting example {index_df.iloc[i]['id']}", e)
                 raise e
@@ -622,6 +703,10 @@ if __name__ == "__main__":
     parser.add_argument("--dataset_path", type=str, default=None)
     parser.add_argument("--max_examples", type=int, default=None)
     parser.add_argument("--num_proc", type=int, default=None)
+    parser.add_argument("--writer_batch_size", type=int, default=None)
+    parser.add_argument(
+        "--tmp_dir", type=str, default=None
+    )  # use a fast scratch disk for large datasets (caching)
     parser.add_argument("--safe_download", action="store_true")
     parser.add_argument("--cleanup", action="store_true")
     args = parser.parse_args()
@@ -688,9 +773,9 @@ if __name__ == "__main__":
             # TODO: switch to array1d when following issue fixed:
             # https://github.com/huggingface/datasets/issues/7243
             # the two sequences basically define the keys and values of a dictionary mapping resids to uniprot ids
-            "receptor_resids_with_uniprot_mapping": Sequence(Value("uint16")),
+            "receptor_resids_with_uniprot_mapping": Sequence(Value("int32")),
             "receptor_mapped_uniprot_resids": Sequence(Value("uint16")),
-            "ligand_resids_with_uniprot_mapping": Sequence(Value("uint16")),
+            "ligand_resids_with_uniprot_mapping": Sequence(Value("int32")),
             "ligand_mapped_uniprot_resids": Sequence(Value("uint16")),
             # selected metadata: anything else can be obtained from the pinder metadata file.
             "oligomeric_count": Value("uint16"),
@@ -704,7 +789,7 @@ if __name__ == "__main__":
 
     # TODO: implement sharding and num_proc
     print(f"Index length: {len(index)} metadata length: {len(metadata)}")
-    with tempfile.TemporaryDirectory() as temp_dir:
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as temp_dir:
         if args.num_proc is None:
             index_list = [index]
         else:
@@ -726,6 +811,7 @@ if __name__ == "__main__":
             split=NamedSplit(split),
             cache_dir=temp_dir,
             num_proc=args.num_proc,
+            writer_batch_size=args.writer_batch_size,
         )
         dataset.push_to_hub(
             "biodatasets/pinder",
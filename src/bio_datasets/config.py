@@ -1,4 +1,9 @@
 import importlib
+import os
 
 FOLDCOMP_AVAILABLE = importlib.util.find_spec("foldcomp") is not None
 FASTPDB_AVAILABLE = importlib.util.find_spec("fastpdb") is not None
+NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
+ISAL_AVAILABLE = importlib.util.find_spec("isal") is not None
+# number of decompressed foldcomp payloads kept in memory (0 disables caching)
+FOLDCOMP_CACHE_SIZE = int(os.environ.get("BIO_DATASETS_FOLDCOMP_CACHE_SIZE", 128))
@@ -3,14 +3,14 @@
 Features are decoded into biotite atom arrays.
 """
 import functools
-import gzip
+import io
 import logging
 import os
 import uuid
 from collections import OrderedDict
 from dataclasses import dataclass, field
 from io import BytesIO, StringIO
-from typing import Any, ClassVar, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import pyarrow as pa
@@ -26,6 +26,13 @@ from datasets.utils.file_utils import is_local_path, xopen, xsplitext
 from datasets.utils.py_utils import no_op_if_value_is_null, string_to_dict
 
 from bio_datasets import config as bio_config
+
+if bio_config.ISAL_AVAILABLE:
+    # drop-in replacement for gzip with a faster (ISA-L) DEFLATE implementation
+    from isal import igzip as gzip
+else:
+    import gzip
+
 from bio_datasets.structure import Biomolecule, BiomoleculeChain, BiomoleculeComplex
 from bio_datasets.structure.biomolecule import (
     create_complete_atom_array_from_restype_index,
@@ -38,10 +45,11 @@ from bio_datasets.structure.protein import (
     ProteinMixin,
 )
 from bio_datasets.structure.protein import constants as protein_constants
-from bio_datasets.structure.residue import ResidueDictionary, get_residue_starts_mask
-
-if bio_config.FOLDCOMP_AVAILABLE:
-    import foldcomp
+from bio_datasets.structure.residue import (
+    ResidueDictionary,
+    get_default_ccd_residue_dictionary,
+    get_residue_index,
+)
 
 from .features import CustomFeature, register_bio_feature
 
@@ -53,6 +61,15 @@ extra_annots = [
     "charge",
     "atom_id",
 ]
+EXTRA_ANNOTS_SET = frozenset(extra_annots)
+# non-standard / ambiguous amino acid letters, mapped to a supported residue type
+SEQUENCE_LETTER_SWAPS = {
+    "U": "C",
+    "O": "K",
+    "B": "X",
+    "J": "X",
+    "Z": "X",
+}
 
 
 def element_from_atom_name(atom_name: np.ndarray, molecule_type: np.ndarray):
@@ -72,43 +89,58 @@ def infer_bytes_format(b: bytes) -> str:
         return "pdb"
 
 
+def _make_sequence_code_lookup() -> np.ndarray:
+    # ascii code of a sequence letter -> residue name ("" for unsupported letters)
+    lookup = np.full(256, "", dtype="<U3")
+    for letter in [*protein_constants.restype_1to3, *SEQUENCE_LETTER_SWAPS]:
+        lookup[ord(letter)] = protein_constants.restype_1to3[
+            SEQUENCE_LETTER_SWAPS.get(letter, letter)
+        ]
+    return lookup
+
+
+SEQUENCE_CODE_TO_RES_NAME = _make_sequence_code_lookup()
+
+
+def _sequence_to_res_names(sequence: str) -> np.ndarray:
+    codes = np.frombuffer(sequence.encode("ascii", errors="replace"), dtype=np.uint8)
+    res_names = SEQUENCE_CODE_TO_RES_NAME[codes]
+    if np.any(res_names == ""):
+        unsupported = set(sequence).difference(
+            protein_constants.restype_1to3, SEQUENCE_LETTER_SWAPS
+        )
+        raise ValueError(f"Unsupported residue letters in sequence: {unsupported}")
+    return res_names
+
+
 def protein_atom_array_from_dict(
     d: Dict, backbone_atoms: Optional[List[str]] = None
 ) -> bs.AtomArray:
-    backbone_atoms = backbone_atoms or ["N", "CA", "C", "O"]
+    if backbone_atoms is None:
+        backbone_atoms = ["N", "CA", "C", "O"]
     sequence = d["sequence"]
-    annots_keys = [k for k in d.keys() if k in extra_annots]
-    swaps = {
-        "U": "C",
-        "O": "K",
-        "B": "X",
-        "J": "X",
-        "Z": "X",
-    }
+    annots_keys = [k for k in d.keys() if k in EXTRA_ANNOTS_SET]
     if "backbone_coords" in d:
         backbone_coords = d["backbone_coords"]
         assert len(sequence) == len(d["backbone_coords"]["N"])
-        atoms = []
-        for res_ix, aa in enumerate(sequence):
-            # TODO: better support for non-standard amino acids
-            aa = swaps.get(aa, aa)
-            res_name = protein_constants.restype_1to3[aa]
-            for atom_name in backbone_atoms:
-                annots = {}
-                for k in annots_keys:
-                    annots[k] = d[k][res_ix]
-                atom = bs.Atom(
-                    coord=backbone_coords[atom_name][res_ix],
-                    chain_id="A",
-                    res_id=res_ix + 1,
-                    res_name=res_name,
-                    hetero=False,
-                    atom_name=atom_name,
-                    element=atom_name[0],  # for protein backbone atoms this is correct
-                    **annots,
-                )
-                atoms.append(atom)
-        arr = bs.array(atoms)
+        num_res, num_bb = len(sequence), len(backbone_atoms)
+        # TODO: better support for non-standard amino acids
+        res_names = _sequence_to_res_names(sequence)
+        arr = bs.AtomArray(num_res * num_bb)
+        # residue-major ordering: (num_res, num_bb, 3) -> (num_res * num_bb, 3)
+        arr.coord = np.stack(
+            [np.asarray(backbone_coords[atom_name]) for atom_name in backbone_atoms],
+            axis=1,
+        ).reshape(-1, 3)
+        arr.chain_id = np.full(len(arr), "A")
+        arr.res_id = np.repeat(np.arange(1, num_res + 1), num_bb)
+        arr.res_name = np.repeat(res_names, num_bb)
+        arr.hetero = np.zeros(len(arr), dtype=bool)
+        arr.atom_name = np.tile(backbone_atoms, num_res)
+        # for protein backbone atoms this is correct
+        arr.element = np.tile([atom_name[0] for atom_name in backbone_atoms], num_res)
+        for k in annots_keys:
+            arr.set_annotation(k, np.repeat(np.asarray(d[k]), num_bb))
         return arr
     elif "atom37_coords" in d:
         raise NotImplementedError("Atom37 not supported yet")
@@ -126,7 +158,8 @@ def encode_biotite_atom_array(
     """
     pdbf = PDBFile()
     pdbf.set_structure(array)
-    contents = "\n".join(pdbf.lines) + "\n"
+    # trailing empty line gives the final newline without copying the joined string again
+    contents = "\n".join([*pdbf.lines, ""])
     if encode_with_foldcomp:
         import foldcomp
 
@@ -137,16 +170,19 @@ def encode_biotite_atom_array(
         return contents.encode()
 
 
-def infer_type_from_structure_file_dict(d: dict) -> Tuple[Optional[str], Optional[str]]:
+@functools.lru_cache(maxsize=4096)
+def _path_extension(path: str) -> str:
+    if path.endswith(".gz"):
+        path = path[:-3]
+    return xsplitext(path)[1][1:]
+
+
+def infer_type_from_structure_file_dict(d: dict) -> Optional[str]:
     if "type" in d and d["type"] is not None:
         return d["type"]
-    elif "path" in d:
-        path = d["path"]
-        if path.endswith(".gz"):
-            path = path[:-3]
-        ext = xsplitext(path)[1][1:]
-        return ext
-    elif "bytes" in d:
+    elif d.get("path") is not None:
+        return _path_extension(d["path"])
+    elif d.get("bytes") is not None:
         return infer_bytes_format(d["bytes"])
     else:
         return None
@@ -168,6 +204,26 @@ def load_structure_from_file_dict(
         return _load_from_bytes(path, bytes_, file_type, extra_fields)
 
 
+@functools.lru_cache(maxsize=4096)
+def _get_repo_id(source_url: str) -> Optional[str]:
+    pattern = (
+        config.HUB_DATASETS_URL
+        if source_url.startswith(config.HF_ENDPOINT)
+        else config.HUB_DATASETS_HFFS_URL
+    )
+    # fast path: repo_id is delimited by the (fixed) text around it in the url pattern
+    prefix, _, rest = pattern.partition("{repo_id}")
+    delimiter = rest.partition("{revision}")[0]
+    if source_url.startswith(prefix):
+        repo_id, found, _ = source_url[len(prefix) :].partition(delimiter)
+        if found and repo_id:
+            return repo_id
+    try:
+        return string_to_dict(source_url, pattern)["repo_id"]
+    except ValueError:
+        return None
+
+
 def _load_from_path(
     path: Optional[str],
     file_type: Optional[str],
@@ -181,19 +237,10 @@ def _load_from_path(
         )
 
     if is_local_path(path):
-        return load_structure(path, file_format=file_type, extra_fields=extra_fields)
+        return load_structure(path, file_type=file_type, extra_fields=extra_fields)
 
-    source_url = path.split("::")[-1]
-    pattern = (
-        config.HUB_DATASETS_URL
-        if source_url.startswith(config.HF_ENDPOINT)
-        else config.HUB_DATASETS_HFFS_URL
-    )
-    try:
-        repo_id = string_to_dict(source_url, pattern)["repo_id"]
-        token = token_per_repo_id.get(repo_id)
-    except ValueError:
-        token = None
+    repo_id = _get_repo_id(path.split("::")[-1])
+    token = token_per_repo_id.get(repo_id) if repo_id is not None else None
 
     download_config = DownloadConfig(token=token)
     with xopen(path, "r", download_config=download_config) as f:
@@ -213,23 +260,52 @@ def _load_from_bytes(
         return load_structure(fhandler, file_type=file_type, extra_fields=extra_fields)
 
     file_type = infer_bytes_format(bytes_)
-    pdb = _decode_bytes(bytes_, file_type)
-    contents = StringIO(pdb)
+    if file_type == "fcz":
+        contents = StringIO(_decode_bytes(bytes_, file_type))
+    else:
+        contents = _get_text_handler(bytes_)
     return load_structure(contents, file_type="pdb", extra_fields=extra_fields)
 
 
+def _get_text_handler(bytes_: bytes) -> io.TextIOWrapper:
+    # decodes on read, rather than copying the contents into a str and then a StringIO
+    fileobj = BytesIO(bytes_)
+    if bytes_.startswith(b"\x1f\x8b"):
+        fileobj = gzip.open(fileobj, "rb")
+    return io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+
+
 def _get_file_handler(bytes_: bytes, file_type: Optional[str]):
-    if file_type == "fcz":
+    if file_type in ["fcz", "bcif"]:
         return BytesIO(bytes_)
     elif file_type in ["pdb", "cif"]:
-        return StringIO(bytes_.decode())
+        return _get_text_handler(bytes_)
     else:
         raise ValueError(f"Unsupported file type: {file_type} for bytes input")
 
 
+def _is_single_chain(chain_id: np.ndarray) -> bool:
+    # short-circuiting comparison against the first label, rather than sorting via np.unique
+    return chain_id.size == 0 or not np.any(chain_id != chain_id[0])
+
+
+def _is_heavy_atom(element: np.ndarray) -> np.ndarray:
+    # two scalar compares are cheaper than np.isin for a two-element needle
+    return (element != "H") & (element != "D")
+
+
+@functools.lru_cache(maxsize=bio_config.FOLDCOMP_CACHE_SIZE)
+def _foldcomp_decompress(bytes_: bytes) -> str:
+    # cached since the same rows are typically decoded once per epoch
+    import foldcomp
+
+    _, pdb = foldcomp.decompress(bytes_)
+    return pdb
+
+
 def _decode_bytes(bytes_: bytes, file_type: Optional[str]) -> str:
     if file_type == "fcz":
-        _, pdb = foldcomp.decompress(bytes_)
+        pdb = _foldcomp_decompress(bytes_)
     else:
         pdb = bytes_.decode()
     return pdb
@@ -284,7 +360,10 @@ class AtomArrayFeature(CustomFeature):
     load_as: str = "biotite"  # biomolecule or chain or complex or biotite; if chain must be monomer
     constructor_kwargs: Optional[Dict] = None
     coords_dtype: str = "float32"
+    # store coords relative to a per-structure origin (preserves float16 precision)
+    with_coords_offset: bool = False
     b_factor_is_plddt: bool = False
+    # integer dtypes are rounded on encode (e.g. uint8 plddt)
     b_factor_dtype: str = "float32"
     with_element: bool = True
     with_hetero: bool = True  # TODO: can be inferred from res_name I guess...
@@ -296,6 +375,8 @@ class AtomArrayFeature(CustomFeature):
     with_atom_id: bool = False
     with_charge: bool = False
     with_ins_code: bool = False
+    # store atom_name / element as indices into residue_dictionary atom_types / element_types
+    encode_atom_types: bool = False
     # Automatically constructed
     _type: str = field(
         default="AtomArrayFeature", init=False, repr=False
@@ -316,7 +397,10 @@ class AtomArrayFeature(CustomFeature):
             ),  # TODO: could make Value(string) if load_as == "chain"
         ]
         if not self.all_atoms_present:
-            features.append(("atom_name", Array1D((None,), "string")))
+            if self.encode_atom_types:
+                features.append(("atomtype_index", Array1D((None,), "uint16")))
+            else:
+                features.append(("atom_name", Array1D((None,), "string")))
             features.append(("residue_starts", Array1D((None,), "uint32")))
         if self.with_res_id:
             features.append(("res_id", Array1D((None,), "uint32")))
@@ -324,6 +408,8 @@ class AtomArrayFeature(CustomFeature):
             features.append(("hetero", Array1D((None,), "bool")))
         if self.with_ins_code:
             features.append(("ins_code", Array1D((None,), "string")))
+        if self.with_coords_offset:
+            features.append(("coords_offset", Array1D((3,), "float32")))
         if self.with_box:
             features.append(("box", Array2D((3, 3), "float32")))
         if self.with_bonds:
@@ -337,7 +423,10 @@ class AtomArrayFeature(CustomFeature):
         if self.with_charge:
             features.append(("charge", Array1D((None,), "int8")))
         if self.with_element:
-            features.append(("element", Array1D((None,), "string")))
+            if self.encode_atom_types:
+                features.append(("elemtype_index", Array1D((None,), "uint8")))
+            else:
+                features.append(("element", Array1D((None,), "string")))
         return OrderedDict(
             features
         )  # order may not be important due to Features.recursive_reorder
@@ -348,14 +437,47 @@ class AtomArrayFeature(CustomFeature):
             assert (
                 self.residue_dictionary is not None
             ), "residue_dictionary is required when all_atoms_present is True"
+        if self.encode_atom_types:
+            assert (
+                self.residue_dictionary is not None
+            ), "residue_dictionary is required when encode_atom_types is True"
         self.deserialize()
         self._features = self._make_features_dict()
+        self._feature_names = list(self._features)
+        self._arrow_type = get_nested_type(self._features)
+        # (attr, stored_per_residue) for enabled optional attributes, precomputed for encoding
+        self._optional_attrs = tuple(
+            (attr, attr == "res_id" or (attr == "b_factor" and self.b_factor_is_plddt))
+            for attr in [
+                "box",
+                "occupancy",
+                "b_factor",
+                "atom_id",
+                "charge",
+                "element",
+                "res_id",
+                "ins_code",
+                "hetero",
+            ]
+            if getattr(self, f"with_{attr}")
+            and not (attr == "element" and self.encode_atom_types)
+        )
+        self._extra_fields = [
+            attr
+            for attr in ["occupancy", "b_factor", "atom_id", "charge"]
+            if getattr(self, f"with_{attr}")
+        ]
+        self._required_keys = ["coords", "atom_name", "res_name", "chain_id"]
+        if self.with_box:
+            self._required_keys.append("box")
+        if self.with_bonds:
+            self._required_keys.append("bonds")
         if not self.with_element and not self.all_atoms_present:
             # TODO: support element inference
             raise ValueError("with_element must be True if all_atoms_present is False")
 
     def __call__(self):
-        return get_nested_type(self._features)
+        return self._arrow_type
 
     def fallback_feature(self):
         return self._features
@@ -366,47 +488,38 @@ class AtomArrayFeature(CustomFeature):
 
     @property
     def required_keys(self):
-        required_keys = ["coords", "atom_name", "res_name", "chain_id"]
-        if self.with_box:
-            required_keys.append("box")
-        if self.with_bonds:
-            required_keys.append("bonds")
-        return required_keys
+        return self._required_keys
 
     @property
     def extra_fields(self):
         # values that can be passed to biotite load_structure
-        extra_fields = []
-        if self.with_occupancy:
-            extra_fields.append("occupancy")
-        if self.with_b_factor:
-            extra_fields.append("b_factor")
-        if self.with_atom_id:
-            extra_fields.append("atom_id")
-        if self.with_charge:
-            extra_fields.append("charge")
-        return extra_fields
+        return self._extra_fields
 
     def cast_storage(self, array: pa.StructArray) -> pa.StructArray:
+        if array.type.equals(self._arrow_type):
+            return array
         null_mask = array.is_null()
-        if null_mask.sum() == len(null_mask):
-            null_array = pa.array([None] * len(array))
+        if array.null_count == len(array):
+            null_array = pa.nulls(len(array))
             arrays = [
                 cast_array_to_feature(null_array, subfeature)
-                for _, subfeature in self._features.items()
+                for subfeature in self._features.values()
             ]
         else:
             array_fields = {field.name for field in array.type}
             # c.f. cast_array_to_feature: since we don't inherit from dict, we reproduce the logic here
-            arrays = [
-                cast_array_to_feature(
-                    array.field(name) if name in array_fields else null_array,
-                    subfeature,
-                )
-                for name, subfeature in self._features.items()
-            ]
+            null_array = None  # only built if some fields are missing
+            arrays = []
+            for name, subfeature in self._features.items():
+                if name in array_fields:
+                    field_array = array.field(name)
+                else:
+                    if null_array is None:
+                        null_array = pa.nulls(len(array))
+                    field_array = null_array
+                arrays.append(cast_array_to_feature(field_array, subfeature))
         return pa.StructArray.from_arrays(
-            arrays, names=list(self._features), mask=null_mask
+            arrays, names=self._feature_names, mask=null_mask
         )
 
     def _encode_example(
@@ -440,58 +553,165 @@ class AtomArrayFeature(CustomFeature):
         else:
             raise ValueError("Expected keys bytes/path/type in dict")
 
-    def _encode_atom_array(self, value: bs.AtomArray, is_standardised: bool) -> dict:
+    def _encode_batch(self, values: List) -> List:
+        # for columns of atom arrays, residue dictionary lookups are done once per batch
+        if (
+            not values
+            or self.residue_dictionary is None
+            or not all(isinstance(value, bs.AtomArray) for value in values)
+        ):
+            return super()._encode_batch(values)
+        arrays, residue_starts_list = [], []
+        for value in values:
+            value, residue_starts = self._prepare_atom_array(
+                self._filter_atom_array(value), is_standardised=False
+            )
+            arrays.append(value)
+            residue_starts_list.append(residue_starts)
+        batch_type_indices = self._get_type_indices(
+            np.concatenate(
+                [
+                    value.res_name[residue_starts]
+                    for value, residue_starts in zip(arrays, residue_starts_list)
+                ]
+            ),
+            np.concatenate([value.atom_name for value in arrays])
+            if self.encode_atom_types
+            else None,
+            np.concatenate([value.element for value in arrays])
+            if self.encode_atom_types
+            else None,
+        )
+        residue_splits = np.cumsum([len(starts) for starts in residue_starts_list])[:-1]
+        atom_splits = np.cumsum([len(value) for value in arrays])[:-1]
+        split_type_indices = {
+            key: np.split(
+                indices, residue_splits if key == "restype_index" else atom_splits
+            )
+            for key, indices in batch_type_indices.items()
+        }
+        return [
+            self._build_atom_array_struct(
+                value,
+                residue_starts,
+                type_indices={
+                    key: indices[i] for key, indices in split_type_indices.items()
+                },
+            )
+            for i, (value, residue_starts) in enumerate(
+                zip(arrays, residue_starts_list)
+            )
+        ]
+
+    def _filter_atom_array(self, value: bs.AtomArray) -> bs.AtomArray:
+        # hook for subclasses which drop unsupported atoms before encoding
+        return value
+
+    def _prepare_atom_array(
+        self, value: bs.AtomArray, is_standardised: bool
+    ) -> Tuple[bs.AtomArray, np.ndarray]:
         if self.all_atoms_present and not is_standardised:
             assert self.residue_dictionary is not None
             value = Biomolecule.standardise_atoms(value, self.residue_dictionary)
         if self.load_as == "chain":
-            chain_ids = np.unique(value.chain_id)
-            assert (
-                len(chain_ids) == 1
+            assert _is_single_chain(
+                value.chain_id
             ), "Only single chain supported when `load_as` == 'chain'"
         residue_starts = get_residue_starts(value)
         if len(residue_starts) > 65535:
             raise ValueError("AtomArray too large to fit in uint16 (residue starts)")
+        return value, residue_starts
+
+    def _encode_atom_array(self, value: bs.AtomArray, is_standardised: bool) -> dict:
+        value, residue_starts = self._prepare_atom_array(value, is_standardised)
         return self._build_atom_array_struct(value, residue_starts)
 
+    def _get_type_indices(
+        self,
+        res_name: np.ndarray,
+        atom_name: Optional[np.ndarray],
+        element: Optional[np.ndarray],
+    ) -> Dict[str, np.ndarray]:
+        # residue dictionary indices for (per-residue) res_name and (per-atom) atom_name/element
+        type_indices = {}
+        if self.residue_dictionary is None:
+            return type_indices
+        type_indices["restype_index"] = self.residue_dictionary.res_name_to_index(
+            res_name
+        )
+        if self.encode_atom_types:
+            if not self.all_atoms_present:
+                type_indices[
+                    "atomtype_index"
+                ] = self.residue_dictionary.atom_name_to_index(atom_name)
+            if self.with_element:
+                type_indices[
+                    "elemtype_index"
+                ] = self.residue_dictionary.element_to_index(element)
+        return type_indices
+
     def _build_atom_array_struct(
-        self, value: bs.AtomArray, residue_starts: np.ndarray
+        self,
+        value: bs.AtomArray,
+        residue_starts: np.ndarray,
+        type_indices: Optional[Dict[str, np.ndarray]] = None,
     ) -> dict:
-        atom_array_struct = {"coords": value.coord}
-        if self.residue_dictionary is not None:
-            atom_array_struct[
-                "restype_index"
-            ] = self.residue_dictionary.res_name_to_index(
-                value.res_name[residue_starts]
+        if type_indices is None:
+            type_indices = self._get_type_indices(
+                value.res_name[residue_starts], value.atom_name, value.element
             )
-        else:
+        atom_array_struct = self._encode_coords(value.coord)
+        atom_array_struct.update(type_indices)
+        if self.residue_dictionary is None:
             atom_array_struct["res_name"] = value.res_name[residue_starts]
         if not self.all_atoms_present:
             atom_array_struct["residue_starts"] = residue_starts
-            atom_array_struct["atom_name"] = value.atom_name
+            if not self.encode_atom_types:
+                atom_array_struct["atom_name"] = value.atom_name
         atom_array_struct["chain_id"] = value.chain_id[residue_starts]
         self._add_optional_attributes(atom_array_struct, value, residue_starts)
         return atom_array_struct
 
+    def _encode_coords(self, coord: np.ndarray) -> dict:
+        if not self.with_coords_offset:
+            return {"coords": coord.astype(self.coords_dtype, copy=False)}
+        # centre of the bounding box minimises the largest stored magnitude
+        if len(coord) > 0:
+            coords_offset = ((coord.min(0) + coord.max(0)) / 2).astype(np.float32)
+        else:
+            coords_offset = np.zeros(3, dtype=np.float32)
+        # subtract straight into a coords_dtype buffer, without a full-width temporary
+        coords = np.empty(coord.shape, dtype=self.coords_dtype)
+        np.subtract(coord, coords_offset, out=coords, casting="same_kind")
+        return {"coords": coords, "coords_offset": coords_offset}
+
     def _add_optional_attributes(
         self, atom_array_struct: dict, value: bs.AtomArray, residue_starts: np.ndarray
     ):
-        for attr in [
-            "box",
-            "occupancy",
-            "b_factor",
-            "atom_id",
-            "charge",
-            "element",
-            "res_id",
-            "ins_code",
-            "hetero",
-        ]:
-            if getattr(self, f"with_{attr}"):
-                if (attr == "b_factor" and self.b_factor_is_plddt) or attr == "res_id":
-                    atom_array_struct[attr] = getattr(value, attr)[residue_starts]
-                else:
-                    atom_array_struct[attr] = getattr(value, attr)
+        # biotite-internal annotation dict, to skip AtomArray.__getattr__ dispatch
+        annotations = getattr(value, "_annot", {})
+        for attr, per_residue in self._optional_attrs:
+            if attr in annotations:
+                attr_value = annotations[attr]
+            else:
+                attr_value = getattr(value, attr)  # e.g. box, which isn't an annotation
+            if per_residue:
+                atom_array_struct[attr] = attr_value[residue_starts]
+            else:
+                atom_array_struct[attr] = attr_value
+        if self.with_b_factor:
+            if np.issubdtype(np.dtype(self.b_factor_dtype), np.integer):
+                dtype_info = np.iinfo(self.b_factor_dtype)
+                atom_array_struct["b_factor"] = np.clip(
+                    np.round(atom_array_struct["b_factor"]),
+                    dtype_info.min,
+                    dtype_info.max,
+                ).astype(self.b_factor_dtype)
+            else:
+                # cast here rather than leaving arrow to convert the wider array
+                atom_array_struct["b_factor"] = np.asarray(
+                    atom_array_struct["b_factor"]
+                ).astype(self.b_factor_dtype, copy=False)
         if self.with_bonds:
             bonds_array = value.bond_list.as_array()
             assert bonds_array.ndim == 2
@@ -501,17 +721,19 @@ class AtomArrayFeature(CustomFeature):
 
     def _encode_path(self, value: Union[str, os.PathLike]) -> dict:
         if os.path.exists(value):
-            file_type = xsplitext(value)[1][1:].lower()
+            # load_structure infers the file type (and handles gzipped files) from the path
             return self._encode_example(
-                load_structure(value, format=file_type, extra_fields=self.extra_fields)
+                load_structure(os.fspath(value), extra_fields=self.extra_fields)
             )
         raise ValueError(f"Path does not exist: {value}")
 
     def _encode_bytes(self, value: bytes) -> dict:
         file_type = infer_bytes_format(value)
-        fhandler = BytesIO(value)
-        return self.encode_example(
-            load_structure(fhandler, format=file_type, extra_fields=self.extra_fields)
+        fhandler = _get_file_handler(value, file_type)
+        return self._encode_example(
+            load_structure(
+                fhandler, file_type=file_type, extra_fields=self.extra_fields
+            )
         )
 
     def _decode_atoms(self, value, token_per_repo_id=None):
@@ -524,9 +746,17 @@ class AtomArrayFeature(CustomFeature):
         else:
             atoms, residue_index = self._decode_partial_atoms(value, num_atoms)
 
-        if self.b_factor_is_plddt and "b_factor" in value:
-            atoms.set_annotation("b_factor", value.pop("b_factor")[residue_index])
-        atoms.coord = value.pop("coords")
+        b_factor = value.pop("b_factor", None)
+        if b_factor is not None:
+            # dequantize any reduced-precision storage (stored values may also be lists)
+            b_factor = np.asarray(b_factor, dtype=np.float32)
+            if self.b_factor_is_plddt:
+                b_factor = b_factor[residue_index]
+            atoms.set_annotation("b_factor", b_factor)
+        coords = np.asarray(value.pop("coords"), dtype=np.float32)
+        if "coords_offset" in value:
+            coords += value.pop("coords_offset")
+        atoms.coord = coords
         if "bond_edges" in value:
             bonds_array = value.pop("bond_edges")
             bond_types = value.pop("bond_types")
@@ -547,13 +777,13 @@ class AtomArrayFeature(CustomFeature):
             chain_id=chain_id,
             backbone_only=self.backbone_only,
         )
-        residue_index = np.cumsum(get_residue_starts_mask(atoms, residue_starts)) - 1
+        residue_index = get_residue_index(residue_starts, len(atoms))
         return atoms, residue_index
 
     def _decode_partial_atoms(self, value, num_atoms):
         atoms = bs.AtomArray(num_atoms)
         residue_starts = value.pop("residue_starts")
-        residue_index = np.cumsum(get_residue_starts_mask(atoms, residue_starts)) - 1
+        residue_index = get_residue_index(residue_starts, num_atoms)
 
         self._set_residue_annotations(value, atoms, residue_index)
 
@@ -571,18 +801,31 @@ class AtomArrayFeature(CustomFeature):
             )
             atoms.set_annotation(
                 "res_name",
-                np.array(self.residue_dictionary.residue_names)[atoms.restype_index],
+                self.residue_dictionary.residue_names_array[atoms.restype_index],
             )
         else:
             atoms.set_annotation("res_name", value.pop("res_name")[residue_index])
 
-        atoms.set_annotation("atom_name", value.pop("atom_name"))
+        if "atomtype_index" in value:
+            atoms.set_annotation(
+                "atom_name",
+                self.residue_dictionary.atom_types_array[value.pop("atomtype_index")],
+            )
+        else:
+            atoms.set_annotation("atom_name", value.pop("atom_name"))
 
         if "chain_id" in value:
             atoms.set_annotation("chain_id", value.pop("chain_id")[residue_index])
         elif self.chain_id is not None:
             atoms.set_annotation("chain_id", np.full(len(atoms), self.chain_id))
-        if self.with_element:
+        if self.with_element and "elemtype_index" in value:
+            atoms.set_annotation(
+                "element",
+                self.residue_dictionary.element_types_array[
+                    value.pop("elemtype_index")
+                ],
+            )
+        elif self.with_element:
             atoms.set_annotation("element", value.pop("element"))
         else:
             raise ValueError("with_element must be True if all_atoms_present is False")
@@ -591,21 +834,26 @@ class AtomArrayFeature(CustomFeature):
         self, value: dict, token_per_repo_id=None
     ) -> Union["bs.AtomArray", None]:
         atoms = self._decode_atoms(value, token_per_repo_id=token_per_repo_id)
-
-        constructor_kwargs = self.constructor_kwargs or {}
         if self.load_as == "biotite":
             return atoms
-        elif self.load_as == "biomolecule":
-            residue_dict = self.residue_dictionary or ResidueDictionary.from_ccd_dict()
-            return Biomolecule(atoms, residue_dict, **constructor_kwargs)
+        return self._decode_constructor(atoms)
+
+    @functools.cached_property
+    def _decode_constructor(self) -> Callable[[bs.AtomArray], Biomolecule]:
+        # bound on first decode, rather than resolving load_as and kwargs per example
+        constructor_kwargs = self.constructor_kwargs or {}
+        residue_dict = self.residue_dictionary or get_default_ccd_residue_dictionary()
+        if self.load_as == "biomolecule":
+            constructor = Biomolecule
         elif self.load_as == "chain":
-            return BiomoleculeChain(atoms, residue_dict, **constructor_kwargs)
+            constructor = BiomoleculeChain
         elif self.load_as == "complex":
-            return BiomoleculeComplex.from_atoms(
-                atoms, residue_dictionary=self.residue_dictionary, **constructor_kwargs
-            )
+            constructor = BiomoleculeComplex.from_atoms
         else:
             raise ValueError(f"Unsupported load_as: {self.load_as}")
+        return functools.partial(
+            constructor, residue_dictionary=residue_dict, **constructor_kwargs
+        )
 
 
 @dataclass
@@ -671,7 +919,7 @@ class StructureFeature(CustomFeature):
             "type": Value("string"),
         }
 
-    @property
+    @functools.cached_property
     def extra_fields(self):
         # values that can be passed to biotite load_structure
         extra_fields = []
@@ -713,9 +961,8 @@ class StructureFeature(CustomFeature):
             return self._encode_dict({"bytes": value})
         elif isinstance(value, bs.AtomArray):
             if self.load_as == "chain":
-                chain_ids = np.unique(value.chain_id)
-                assert (
-                    len(chain_ids) == 1
+                assert _is_single_chain(
+                    value.chain_id
                 ), "Only single chain supported when `load_as` == 'chain'"
             return {
                 "path": None,
@@ -764,31 +1011,35 @@ class StructureFeature(CustomFeature):
             `biotite.AtomArray`
         """
         atoms = self._decode_atoms(value, token_per_repo_id=token_per_repo_id)
-        constructor_kwargs = self.constructor_kwargs or {}
         if self.load_as == "biotite":
             return atoms
+        return self._decode_constructor(atoms)
+
+    @functools.cached_property
+    def _decode_constructor(self) -> Callable[[bs.AtomArray], Biomolecule]:
+        # bound on first decode, rather than resolving load_as and kwargs per example
         if self.load_as == "biomolecule":
-            return Biomolecule(atoms, **constructor_kwargs)
+            constructor = Biomolecule
         elif self.load_as == "chain":
-            return BiomoleculeChain(atoms, **constructor_kwargs)
+            constructor = BiomoleculeChain
         elif self.load_as == "complex":
-            return BiomoleculeComplex.from_atoms(
-                atoms,
-                **constructor_kwargs,
-            )
+            constructor = BiomoleculeComplex.from_atoms
         else:
             raise ValueError(f"Unsupported load_as: {self.load_as}")
+        return functools.partial(constructor, **(self.constructor_kwargs or {}))
 
     def cast_storage(self, storage: pa.StructArray) -> pa.StructArray:
+        if storage.type.equals(self.pa_type):
+            return storage
         if pa.types.is_struct(storage.type):
             if storage.type.get_field_index("bytes") >= 0:
                 bytes_array = storage.field("bytes")
             else:
-                bytes_array = pa.array([None] * len(storage), type=pa.binary())
+                bytes_array = pa.nulls(len(storage), type=pa.binary())
             if storage.type.get_field_index("path") >= 0:
                 path_array = storage.field("path")
             else:
-                path_array = pa.array([None] * len(storage), type=pa.string())
+                path_array = pa.nulls(len(storage), type=pa.string())
             storage = pa.StructArray.from_arrays(
                 [bytes_array, path_array, storage.field("type")],
                 names=["bytes", "path", "type"],
@@ -796,7 +1047,7 @@ class StructureFeature(CustomFeature):
             )
         else:
             raise ValueError(f"Unsupported storage type: {storage.type}")
-        return array_cast(storage, self.pa_type)
+        return self._cast_if_needed(storage)
 
     def embed_storage(self, storage: pa.StructArray) -> pa.StructArray:
         """Embed the file contents into the Arrow table.
@@ -810,25 +1061,27 @@ class StructureFeature(CustomFeature):
             with xopen(path, "rb") as f:
                 bytes_ = f.read()
             if path.endswith(".gz"):
-                assert is_local_path(path), "Gzipped files must have local file paths."
-                with gzip.open(path, "rb") as f:
-                    bytes_ = f.read()
+                # decompress what was already read instead of reading the file again
+                bytes_ = gzip.decompress(bytes_)
             return bytes_
 
+        # read the child columns directly rather than materialising each row as a dict
+        is_null = storage.is_null().to_pylist()
+        paths = storage.field("path").to_pylist()
         bytes_array = pa.array(
-            [
-                (path_to_bytes(x["path"]) if x["bytes"] is None else x["bytes"])
-                if x is not None
-                else None
-                for x in storage.to_pylist()
-            ],
+            (
+                None
+                if null
+                else (bytes_ if bytes_ is not None else path_to_bytes(path))
+                for null, bytes_, path in zip(
+                    is_null, storage.field("bytes").to_pylist(), paths
+                )
+            ),
             type=pa.binary(),
+            size=len(storage),
         )
         path_array = pa.array(
-            [
-                os.path.basename(path) if path is not None else None
-                for path in storage.field("path").to_pylist()
-            ],
+            [os.path.basename(path) if path is not None else None for path in paths],
             type=pa.string(),
         )
         type_array = storage.field("type")
@@ -837,6 +1090,12 @@ class StructureFeature(CustomFeature):
             ["bytes", "path", "type"],
             mask=bytes_array.is_null(),
         )
+        return self._cast_if_needed(storage)
+
+    def _cast_if_needed(self, storage: pa.StructArray) -> pa.StructArray:
+        # array_cast re-walks every child array, so skip it when the types already match
+        if storage.type.equals(self.pa_type):
+            return storage
         return array_cast(storage, self.pa_type)
 
 
@@ -866,30 +1125,34 @@ class ProteinStructureFeature(StructureFeature):
                 "No residue_dictionary provided for ProteinStructureFeature, default ProteinDictionary will be used to decode."
             )
 
-    def encode_example(self, value: Union[ProteinMixin, dict, bs.AtomArray]) -> dict:
+    def _encode_example(self, value: Union[ProteinMixin, dict, bs.AtomArray]) -> dict:
+        # filtered here rather than in encode_example so that batch encoding applies it too
         if isinstance(value, bs.AtomArray):
-            value = value[filter_amino_acids(value)]
-            value = value[~np.isin(value.element, ["H", "D"])]
-        return super().encode_example(value)
+            value = value[filter_amino_acids(value) & _is_heavy_atom(value.element)]
+        return super()._encode_example(value)
 
     def _decode_example(
         self, encoded: dict, token_per_repo_id=None
     ) -> Union["ProteinChain", "ProteinComplex", None]:
         atoms = self._decode_atoms(encoded, token_per_repo_id=token_per_repo_id)
         # TODO: filter amino acids in encode_example also where possible
-        constructor_kwargs = self.constructor_kwargs or {}
         if self.load_as == "biotite":
             return atoms
-        elif self.load_as == "biomolecule":
+        return self._decode_constructor(atoms)
+
+    @functools.cached_property
+    def _decode_constructor(self) -> Callable[[bs.AtomArray], ProteinMixin]:
+        if self.load_as == "biomolecule":
             raise ValueError(
                 "Returning biomolecule for protein-specific feature not supported."
             )
         elif self.load_as == "chain":
-            return ProteinChain(atoms, **constructor_kwargs)
+            constructor = ProteinChain
         elif self.load_as == "complex":
-            return ProteinComplex.from_atoms(atoms, **constructor_kwargs)
+            constructor = ProteinComplex.from_atoms
         else:
             raise ValueError(f"Unsupported load_as: {self.load_as}")
+        return functools.partial(constructor, **(self.constructor_kwargs or {}))
 
 
 @dataclass
@@ -935,6 +1198,13 @@ class ProteinAtomArrayFeature(AtomArrayFeature):
             assert isinstance(
                 self.residue_dictionary, ProteinDictionary
             ), "residue_dictionary must be a ProteinDictionary"
+        # precomputed once for backbone_only filtering and encoding sequence dicts
+        backbone_atoms = (
+            self.residue_dictionary.backbone_atoms
+            if self.residue_dictionary is not None
+            else None
+        )
+        self._backbone_atoms = np.asarray(backbone_atoms or ["N", "CA", "C", "O"])
 
     @classmethod
     def from_preset(cls, preset: str, **kwargs):
@@ -944,9 +1214,9 @@ class ProteinAtomArrayFeature(AtomArrayFeature):
                 residue_dictionary=residue_dictionary,
                 with_b_factor=True,
                 b_factor_is_plddt=True,
-                # b_factor_dtype="uint8"
-                b_factor_dtype="float16",
+                b_factor_dtype="uint8",  # plddt is in [0, 100]
                 coords_dtype="float16",
+                with_coords_offset=True,
                 all_atoms_present=True,
                 with_element=False,
                 with_hetero=False,
@@ -958,6 +1228,7 @@ class ProteinAtomArrayFeature(AtomArrayFeature):
                 residue_dictionary=residue_dictionary,
                 with_b_factor=False,
                 coords_dtype="float16",
+                with_coords_offset=True,
                 **kwargs,
             )
         else:
@@ -968,13 +1239,8 @@ class ProteinAtomArrayFeature(AtomArrayFeature):
         value: Union[ProteinMixin, dict, bs.AtomArray],
     ) -> dict:
         if isinstance(value, dict) and "sequence" in value:
-            value = protein_atom_array_from_dict(
-                value,
-                self.residue_dictionary.backbone_atoms
-                if self.residue_dictionary
-                else ["N", "CA", "C", "O"],
-            )
-            return self.encode_example(value)
+            # falls through to the AtomArray branch below
+            value = protein_atom_array_from_dict(value, self._backbone_atoms)
         if isinstance(value, ProteinMixin):
             # TODO: switch to extracting backbone.
             if self.backbone_only:
@@ -983,41 +1249,45 @@ class ProteinAtomArrayFeature(AtomArrayFeature):
                 value.atoms, is_standardised=value.is_standardised
             )
         if isinstance(value, bs.AtomArray):
-            value = value[~np.isin(value.element, ["H", "D"])]
-            value = value[filter_amino_acids(value)]
-            if not self.residue_dictionary.keep_oxt:
-                value = value[value.atom_name != "OXT"]
-            if self.backbone_only:
-                backbone_mask = np.isin(
-                    value.atom_name, self.residue_dictionary.backbone_atoms
-                )
-                value = value[backbone_mask]
-            return super()._encode_example(value)
+            return super()._encode_example(self._filter_atom_array(value))
         return super()._encode_example(value)
 
+    def _filter_atom_array(self, value: bs.AtomArray) -> bs.AtomArray:
+        # combine the masks so that the annotation arrays are only copied once
+        mask = filter_amino_acids(value) & _is_heavy_atom(value.element)
+        if not self.residue_dictionary.keep_oxt:
+            mask &= value.atom_name != "OXT"
+        if self.backbone_only:
+            mask &= np.isin(value.atom_name, self._backbone_atoms)
+        return value[mask]
+
     def _decode_example(
         self, encoded: dict, token_per_repo_id=None
     ) -> Union["ProteinChain", "ProteinComplex", None]:
         atoms = self._decode_atoms(encoded, token_per_repo_id=token_per_repo_id)
         if atoms is None:
             return None
-        constructor_kwargs = self.constructor_kwargs or {}
         if self.load_as == "biotite":
             return atoms
-        elif self.load_as == "biomolecule":
+        return self._decode_constructor(atoms)
+
+    @functools.cached_property
+    def _decode_constructor(self) -> Callable[[bs.AtomArray], ProteinMixin]:
+        if self.load_as == "biomolecule":
             raise ValueError(
                 "Returning biomolecule for protein-specific feature not supported."
             )
         elif self.load_as == "chain":
-            return ProteinChain(
-                atoms, residue_dictionary=self.residue_dictionary, **constructor_kwargs
-            )
+            constructor = ProteinChain
         elif self.load_as == "complex":
-            return ProteinComplex.from_atoms(
-                atoms, residue_dictionary=self.residue_dictionary, **constructor_kwargs
-            )
+            constructor = ProteinComplex.from_atoms
         else:
             raise ValueError(f"Unsupported load_as: {self.load_as}")
+        return functools.partial(
+            constructor,
+            residue_dictionary=self.residue_dictionary,
+            **(self.constructor_kwargs or {}),
+        )
 
 
 register_bio_feature(StructureFeature)
@@ -4,7 +4,7 @@ Custom features for bio datasets.
 Written to ensure compatibility with datasets loading / uploading when bio datasets not available.
 """
 import json
-from typing import ClassVar, Dict, Optional, Union
+from typing import Any, ClassVar, Dict, List, Optional, Union
 
 import numpy as np
 import pyarrow as pa
@@ -47,6 +47,18 @@ class CustomFeature:
             "Should be implemented by child class if `requires_encoding` is True"
         )
 
+    def encode_batch(self, examples: List[Any]) -> List[Any]:
+        if self.requires_encoding:
+            return self._encode_batch(examples)
+        return examples
+
+    def _encode_batch(self, examples: List[Any]) -> List[Any]:
+        # child classes can override this to share work across the examples in a batch
+        return [
+            self._encode_example(example) if example is not None else None
+            for example in examples
+        ]
+
     def decode_example(self, example, token_per_repo_id=None):
         if self.requires_decoding:
             return self._decode_example(example, token_per_repo_id=token_per_repo_id)
@@ -188,6 +200,13 @@ def encode_nested_example(schema, obj, level: int = 0):  # noqa: CCR001
     return obj
 
 
+def encode_nested_column(schema, column: list) -> list:
+    # top-level custom features encode the whole column at once (c.f. CustomFeature.encode_batch)
+    if isinstance(schema, CustomFeature):
+        return schema.encode_batch(column)
+    return [encode_nested_example(schema, obj, level=1) for obj in column]
+
+
 def decode_nested_example(  # noqa: CCR001
     schema, obj, token_per_repo_id: Optional[Dict[str, Union[str, bool, None]]] = None
 ):
@@ -411,9 +430,7 @@ class Features(Features, dict):
             `list[Any]`
         """
         column = cast_to_python_objects(column)
-        return [
-            encode_nested_example(self[column_name], obj, level=1) for obj in column
-        ]
+        return encode_nested_column(self[column_name], column)
 
     def encode_batch(self, batch):
         """
@@ -433,9 +450,7 @@ class Features(Features, dict):
             )
         for key, column in batch.items():
             column = cast_to_python_objects(column)
-            encoded_batch[key] = [
-                encode_nested_example(self[key], obj, level=1) for obj in column
-            ]
+            encoded_batch[key] = encode_nested_column(self[key], column)
         return encoded_batch
 
     def decode_example(
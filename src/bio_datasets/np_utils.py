@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 
@@ -17,3 +17,40 @@ def map_categories_to_indices(arr: np.ndarray, categories: List[str]) -> np.ndar
     unique_categories, indices = np.unique(arr, return_inverse=True)
     category_indices = np.array([categories.index(i) for i in unique_categories])
     return category_indices[indices]
+
+
+def sort_categories(categories: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Precompute the sorted lookup table used by `lookup_category_indices`.
+
+    Args:
+        categories (List[str]): The list of categories to map to indices.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The sorted categories, and the index of each
+            sorted category in the original list (first occurrence for duplicates).
+    """
+    categories = np.asarray(categories)
+    sort_order = np.argsort(categories, kind="stable")
+    return categories[sort_order], sort_order
+
+
+def lookup_category_indices(
+    arr: np.ndarray, sorted_categories: np.ndarray, sort_order: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorised equivalent of `map_categories_to_indices`, via binary search.
+
+    Args:
+        arr (np.ndarray): The input array of categories.
+        sorted_categories (np.ndarray): Sorted categories, from `sort_categories`.
+        sort_order (np.ndarray): Original indices of sorted categories, from `sort_categories`.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: An array of indices corresponding to the categories,
+            and a mask of which elements of arr were found (indices are invalid elsewhere).
+    """
+    positions = np.searchsorted(sorted_categories, arr)
+    positions = np.minimum(positions, len(sorted_categories) - 1)
+    found = sorted_categories[positions] == arr
+    return sort_order[positions], found
@@ -6,13 +6,13 @@ from biotite import structure as bs
 from biotite.structure.io.pdb import PDBFile
 from biotite.structure.residues import get_residue_starts
 
-from bio_datasets.np_utils import map_categories_to_indices
 from bio_datasets.structure.parsing import load_structure
 
 from .residue import (
     ResidueDictionary,
     create_complete_atom_array_from_restype_index,
-    get_residue_starts_mask,
+    get_default_ccd_residue_dictionary,
+    get_residue_index,
 )
 
 # from biotite.structure.filter import filter_highest_occupancy_altloc  performed automatically by biotite
@@ -85,7 +85,7 @@ class Biomolecule(Generic[T]):
     ):
         if residue_dictionary is None:
             residue_dictionary = (
-                ResidueDictionary.from_ccd_dict()
+                get_default_ccd_residue_dictionary()
             )  # TODO: better default?
         atoms = load_structure(
             file_path, file_type=file_type, extra_fields=extra_fields
@@ -126,30 +126,33 @@ class Biomolecule(Generic[T]):
         raise_error_on_unexpected: bool = False,
         keep_hydrogens: bool = False,
     ):
+        # build a single mask, so that the annotation arrays are only copied once
         # drop water
-        atoms = atoms[atoms.res_name != "HOH"]
+        mask = atoms.res_name != "HOH"
         if not keep_hydrogens:
             assert (
                 "element" in atoms._annot
             ), "Elements must be present to exclude hydrogens"
-            atoms = atoms[~np.isin(atoms.element, ["H", "D"])]
+            mask &= (atoms.element != "H") & (atoms.element != "D")
         if residue_dictionary is None or not getattr(
             residue_dictionary, "keep_oxt", False
         ):
             # oxt complicates things for residue dictionary.
-            atoms = atoms[atoms.atom_name != "OXT"]
+            mask &= atoms.atom_name != "OXT"
         # TODO: we actually want to use residue_dictionary.residue_atoms
         if residue_dictionary is not None:
-            expected_residue_mask = np.isin(
-                atoms.res_name, residue_dictionary.residue_names
+            expected_residue_mask = residue_dictionary.res_name_in_dictionary(
+                atoms.res_name
             )
-            if raise_error_on_unexpected and ~expected_residue_mask.any():
-                unexpected_residues = np.unique(atoms[~expected_residue_mask].res_name)
+            if raise_error_on_unexpected and not expected_residue_mask[mask].all():
+                unexpected_residues = np.unique(
+                    atoms.res_name[mask & ~expected_residue_mask]
+                )
                 raise ValueError(
                     f"Found unexpected residues: {unexpected_residues} in atom array"
                 )
-            return atoms[expected_residue_mask]
-        return atoms
+            mask &= expected_residue_mask
+        return atoms[mask]
 
     @staticmethod
     def reorder_chains(atoms):
@@ -179,9 +182,7 @@ class Biomolecule(Generic[T]):
         ):
             atoms.set_annotation(
                 "atomtype_index",
-                map_categories_to_indices(
-                    atoms.atom_name, residue_dictionary.atom_types
-                ),
+                residue_dictionary.atom_name_to_index(atoms.atom_name),
             )
         if (
             "elemtype_index" not in atoms._annot
@@ -189,9 +190,7 @@ class Biomolecule(Generic[T]):
         ):
             atoms.set_annotation(
                 "elemtype_index",
-                map_categories_to_indices(
-                    atoms.element, residue_dictionary.element_types
-                ),
+                residue_dictionary.element_to_index(atoms.element),
             )
         if "restype_index" not in atoms._annot:
             atoms.set_annotation(
@@ -200,7 +199,7 @@ class Biomolecule(Generic[T]):
 
         atoms.set_annotation(
             "res_index",
-            np.cumsum(get_residue_starts_mask(atoms, residue_starts)) - 1,
+            get_residue_index(residue_starts, len(atoms)),
         )
 
         (
@@ -301,9 +300,7 @@ class Biomolecule(Generic[T]):
 
         new_atom_array.set_annotation(
             "atomtype_index",
-            map_categories_to_indices(
-                new_atom_array.atom_name, residue_dictionary.atom_types
-            ),
+            residue_dictionary.atom_name_to_index(new_atom_array.atom_name),
         )
         assert np.all(
             new_atom_array.atom_name != ""
@@ -541,7 +538,7 @@ class BaseBiomoleculeComplex(Biomolecule):
         # basically ensures that chains are in alphabetical order and all constituents are single-chain.
         chain_ids = sorted(np.unique(atoms.chain_id))
         if residue_dictionary is None:
-            residue_dictionary = ResidueDictionary.from_ccd_dict()
+            residue_dictionary = get_default_ccd_residue_dictionary()
         return cls(
             [
                 BiomoleculeChain(
@@ -3,9 +3,10 @@ from typing import List
 import numpy as np
 from biotite import structure as bs
 from biotite.structure.info.ccd import get_from_ccd
+from biotite.structure.residues import get_residue_starts
 
 from bio_datasets.structure.biomolecule import Biomolecule
-from bio_datasets.structure.residue import ResidueDictionary, get_residue_starts_mask
+from bio_datasets.structure.residue import ResidueDictionary, get_residue_index
 
 
 def get_smiles_from_ccd(res_name: str, program: str = "CACTVS"):
@@ -118,7 +119,7 @@ def to_small_molecules(atoms: bs.AtomArray) -> List[SmallMolecule]:
     else:
         atoms.set_annotation(
             "res_index",
-            np.cumsum(get_residue_starts_mask(atoms)) - 1,
+            get_residue_index(get_residue_starts(atoms), len(atoms)),
         )
         res_indices = np.unique(atoms.res_index)
     for res_idx in res_indices:  # residue index should be sorted; res_id may not be
@@ -8,37 +8,19 @@ from biotite.structure.filter import (
     _canonical_nucleotide_list,
     _phosphate_backbone_atoms,
 )
-from biotite.structure.info.ccd import get_ccd
-from biotite.structure.io.pdbx import get_component
 
 from bio_datasets.structure.biomolecule import BiomoleculeChain
-from bio_datasets.structure.residue import ResidueDictionary
+from bio_datasets.structure.residue import (
+    ResidueDictionary,
+    get_ccd_residue_atoms_and_elements,
+)
 
 dna_nucleotides = ["DA", "DC", "DG", "DT"]
 rna_nucleotides = ["A", "C", "G", "U"]
 
 
 def get_residue_atoms_and_elements(residue_names):
-    residue_atoms = {}
-    residue_elements = {}
-    ccd_data = get_ccd()
-    for resname in residue_names:
-        comp = get_component(ccd_data, res_name=resname)
-        atoms = [
-            at
-            for at in comp.atom_name
-            if not at.startswith("H") and not at.startswith("D")
-        ]
-        elements = [
-            elem
-            for at, elem in zip(comp.atom_name, comp.element)
-            if elem != "H" and elem != "D" and at != "OXT"
-        ]
-        assert len(atoms) == len(elements)
-        residue_atoms[resname] = atoms
-        residue_elements[resname] = elements
-
-    return residue_atoms, residue_elements
+    return get_ccd_residue_atoms_and_elements(residue_names)
 
 
 residue_atoms, residue_elements = get_residue_atoms_and_elements(
@@ -1,4 +1,4 @@
-import gzip
+import io
 import os
 from os import PathLike
 from typing import Optional
@@ -10,8 +10,10 @@ from bio_datasets import config as bio_config
 if bio_config.FASTPDB_AVAILABLE:
     import fastpdb
 
-if bio_config.FOLDCOMP_AVAILABLE:
-    import foldcomp
+if bio_config.ISAL_AVAILABLE:
+    from isal import igzip as gzip
+else:
+    import gzip
 
 from biotite import structure as bs
 from biotite.structure.filter import (
@@ -20,6 +22,7 @@ from biotite.structure.filter import (
 )
 from biotite.structure.io import pdbx
 from biotite.structure.io.pdb import PDBFile
+from biotite.structure.io.pdbx import MaskValue
 from biotite.structure.io.pdbx.convert import (
     _filter_model,
     _get_block,
@@ -28,9 +31,9 @@ from biotite.structure.io.pdbx.convert import (
 from biotite.structure.residues import get_residue_starts
 
 from .residue import (
-    ResidueDictionary,
     create_complete_atom_array_from_restype_index,
-    get_residue_starts_mask,
+    get_default_ccd_residue_dictionary,
+    get_residue_index,
 )
 
 FILE_TYPE_TO_EXT = {
@@ -102,8 +105,8 @@ def fill_missing_polymer_chain_residues(
     post_perm_residue_starts = np.concatenate(
         [[0], np.where(post_perm_res_changes)[0] + 1]
     )
-    _post_perm_res_index = (
-        np.cumsum(get_residue_starts_mask(complete_atoms, post_perm_residue_starts)) - 1
+    _post_perm_res_index = get_residue_index(
+        post_perm_residue_starts, len(complete_atoms)
     )
 
     permuted_relative_atom_index = (
@@ -121,7 +124,7 @@ def fill_missing_polymer_residues(
 ):
     """Fill in missing residues for polymer entities."""
     processed_chain_atoms = []
-    residue_dict = ResidueDictionary.from_ccd_dict()
+    residue_dict = get_default_ccd_residue_dictionary()
     for entity_chain_ids, entity_id in zip(poly_chain_ids, poly_entity_ids):
         poly_seq_entity_mask = (
             entity_poly_seq["entity_id"].as_array(int, -1) == entity_id
@@ -291,6 +294,8 @@ def _load_foldcomp_structure(
             fcz_binary = fcz.read()
     else:
         raise ValueError("Unsupported file type: expected path or bytes handler")
+    import foldcomp
+
     (_, pdb_str) = foldcomp.decompress(fcz_binary)
     lines = pdb_str.splitlines()
     pdbf = PDBFile()
@@ -368,3 +373,69 @@ def load_structure(
         )
     else:
         raise ValueError(f"Unsupported file format: {file_type}")
+
+
+def _formats_back_exactly(strings: np.ndarray, numbers: np.ndarray) -> bool:
+    """Check that numbers converted from strings print back to the same strings.
+
+    Floats are printed with the number of decimals of their source string, so that
+    e.g. coordinates written as 10.100 round-trip.
+    """
+    if numbers.dtype.kind == "i":
+        return bool(np.all(np.char.mod("%d", numbers) == strings))
+    point = np.char.find(strings, ".")
+    decimals = np.where(point >= 0, np.char.str_len(strings) - point - 1, 0)
+    for n_decimals in np.unique(decimals):
+        in_group = decimals == n_decimals
+        formatted = np.char.mod(f"%.{n_decimals}f", numbers[in_group])
+        if not np.all(formatted == strings[in_group]):
+            return False
+    return True
+
+
+def _into_fitting_type(string_array, mask):
+    """Try to find a numeric type for a string ndarray (c.f. setup_ccd.py).
+
+    Unlike setup_ccd.py, columns are only converted if this is lossless: strings
+    such as symmetry operators (1_555) or zero-padded ids (004) parse as numbers
+    but would not be written back the same.
+    """
+    if mask is None:
+        present = np.ones(string_array.shape, dtype=bool)
+    else:
+        present = mask == MaskValue.PRESENT
+    strings = string_array[present]
+    values = strings
+    for dtype in [int, float]:
+        try:
+            numbers = strings.astype(dtype)
+        except ValueError:
+            continue
+        if _formats_back_exactly(strings, numbers):
+            values = numbers
+        break
+    array = np.zeros(string_array.shape, dtype=values.dtype)
+    array[present] = values
+    return array
+
+
+def cif_to_bcif(cif_bytes: bytes) -> bytes:
+    """Convert mmCIF contents to compressed BinaryCIF bytes in-process."""
+    cif_file = pdbx.CIFFile.read(io.StringIO(cif_bytes.decode()))
+    bcif_file = pdbx.BinaryCIFFile()
+    for block_name, block in cif_file.items():
+        bcif_block = pdbx.BinaryCIFBlock()
+        for category_name, category in block.items():
+            bcif_columns = {}
+            for column_name, column in category.items():
+                mask = column.mask.array if column.mask is not None else None
+                bcif_columns[column_name] = pdbx.BinaryCIFColumn(
+                    _into_fitting_type(column.data.array, mask), mask
+                )
+            bcif_block[category_name] = pdbx.BinaryCIFCategory(bcif_columns)
+        bcif_file[block_name] = bcif_block
+    if hasattr(pdbx, "compress"):  # added in biotite 1.1
+        bcif_file = pdbx.compress(bcif_file)
+    buffer = io.BytesIO()
+    bcif_file.write(buffer)
+    return buffer.getvalue()
@@ -19,8 +19,8 @@ import collections
 from typing import Mapping
 
 import numpy as np
-from biotite.structure.info.ccd import get_ccd
-from biotite.structure.io.pdbx import get_component
+
+from bio_datasets.structure.residue import get_ccd_residue_atoms_and_elements
 
 # Distance from one CA to next CA [trans configuration: omega = 180].
 ca_ca = 3.80209737096
@@ -491,28 +491,12 @@ resname_to_idx = {resname: i for i, resname in enumerate(resnames)}
 
 
 def get_residue_atoms_and_elements(residue_names):
-    residue_atoms = {}
-    residue_elements = {}
-    ccd_data = get_ccd()
-    for resname in residue_names:
-        comp = get_component(ccd_data, res_name=resname)
-        if resname == "UNK":
-            atoms = ["N", "CA", "C", "O"]
-        else:
-            atoms = [
-                at
-                for at in comp.atom_name
-                if at != "OXT" and not at.startswith("H") and not at.startswith("D")
-            ]
-            elements = [
-                elem
-                for at, elem in zip(comp.atom_name, comp.element)
-                if elem != "H" and elem != "D" and at != "OXT"
-            ]
-            assert len(atoms) == len(elements)
-        residue_atoms[resname] = atoms
-        residue_elements[resname] = elements
-
+    residue_atoms, residue_elements = get_ccd_residue_atoms_and_elements(
+        [resname for resname in residue_names if resname != "UNK"]
+    )
+    if "UNK" in residue_names:
+        residue_atoms["UNK"] = ["N", "CA", "C", "O"]
+        residue_elements["UNK"] = ["N", "C", "C", "O"]
     return residue_atoms, residue_elements
 
 
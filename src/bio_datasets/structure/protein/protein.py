@@ -6,6 +6,7 @@ for dealing with protein structures in an ML context; specifically exposing resi
 including coordinates and distances.
 """
 import copy
+import functools
 from dataclasses import dataclass
 from typing import List, Optional, Union
 
@@ -146,6 +147,15 @@ class ProteinDictionary(ResidueDictionary):
         return elements
 
 
+@functools.lru_cache(maxsize=None)
+def get_default_protein_dictionary(keep_oxt: bool = False) -> ProteinDictionary:
+    """Shared "protein" preset ProteinDictionary, built once per process.
+
+    Used as the fallback when no residue dictionary is provided; treat as read-only.
+    """
+    return ProteinDictionary.from_preset("protein", keep_oxt=keep_oxt)
+
+
 def filter_backbone(array, residue_dictionary):
     """
     Filter all peptide backbone atoms of one array.
@@ -258,9 +268,7 @@ class ProteinChain(ProteinMixin, BiomoleculeChain):
         raise_error_on_unexpected: bool = False,
     ):
         if residue_dictionary is None:
-            residue_dictionary = ProteinDictionary.from_preset(
-                "protein", keep_oxt=keep_oxt
-            )
+            residue_dictionary = get_default_protein_dictionary(keep_oxt)
         else:
             assert keep_oxt == getattr(residue_dictionary, "keep_oxt", False)
         super().__init__(
@@ -1,15 +1,20 @@
+import functools
 import itertools
 import json
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
 from biotite import structure as bs
 from biotite.structure.info.ccd import get_ccd
 from biotite.structure.residues import get_residue_starts
 
-from bio_datasets.np_utils import map_categories_to_indices
+from bio_datasets import config as bio_config
+from bio_datasets.np_utils import lookup_category_indices, sort_categories
+
+if bio_config.NUMBA_AVAILABLE:
+    import numba
 
 
 def get_ccd_dict():
@@ -105,27 +110,32 @@ def get_component_types():
     return dict(zip(RES_NAMES, res_types))
 
 
+CHEM_TYPE_CATEGORIES = {
+    **{chem_type: "protein" for chem_type in PROTEIN_TYPES},
+    **{chem_type: "dna" for chem_type in DNA_TYPES},
+    **{chem_type: "rna" for chem_type in RNA_TYPES},
+    **{chem_type: "carbohydrate" for chem_type in CARBOHYDRATE_TYPES},
+    **{chem_type: "small_molecule" for chem_type in CHEMICAL_TYPES},
+}
+
+
 def get_component_categories(chem_component_types: Dict[str, str]):
     categories = {}
     for name, chem_type in chem_component_types.items():
         chem_type = chem_type.strip().upper()
-        if chem_type in PROTEIN_TYPES:
-            categories[name] = "protein"
-        elif chem_type in DNA_TYPES:
-            categories[name] = "dna"
-        elif chem_type in RNA_TYPES:
-            categories[name] = "rna"
-        elif chem_type in CARBOHYDRATE_TYPES:
-            categories[name] = "carbohydrate"
-        elif chem_type in CHEMICAL_TYPES:
-            categories[name] = "small_molecule"
-        else:
+        if chem_type not in CHEM_TYPE_CATEGORIES:
             raise ValueError(f"Unknown chemical component type: {chem_type}")
+        categories[name] = CHEM_TYPE_CATEGORIES[chem_type]
     return categories
 
 
 # useful to store this globally because it helps us split chains in complex.py
 CHEM_COMPONENT_CATEGORIES = get_component_categories(get_component_types())
+# array versions (sorted by residue name) for vectorised lookups
+_SORTED_COMPONENT_NAMES, _COMPONENT_NAMES_ORDER = sort_categories(
+    list(CHEM_COMPONENT_CATEGORIES)
+)
+_COMPONENT_CATEGORIES_ARRAY = np.array(list(CHEM_COMPONENT_CATEGORIES.values()))
 
 
 def get_component_3to1():
@@ -135,13 +145,59 @@ def get_component_3to1():
     return {name: code for name, code in zip(res_names, res_types) if code}
 
 
+def get_ccd_residue_atoms_and_elements(
+    res_names: List[str], keep_hydrogens: bool = False, keep_oxt: bool = False
+) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+    """Atom names and elements of each CCD component, in CCD order.
+
+    The flat chem_comp_atom table is filtered once then sliced per residue,
+    rather than filtering the full table for every component.
+    """
+    chem_comp_atom = get_ccd()["chem_comp_atom"]
+    comp_ids = chem_comp_atom["comp_id"].as_array(str)
+    atom_names = chem_comp_atom["atom_id"].as_array(str)
+    elements = chem_comp_atom["type_symbol"].as_array(str)
+    # select the requested components before applying the per-atom filters,
+    # as chem_comp_atom covers the whole CCD
+    order = np.flatnonzero(np.isin(comp_ids, list(res_names)))
+    mask = np.ones(len(order), dtype=bool)
+    if not keep_hydrogens:
+        mask &= (elements[order] != "H") & (elements[order] != "D")
+    if not keep_oxt:
+        mask &= atom_names[order] != "OXT"
+    order = order[mask]
+    # stable sort groups atoms by residue, preserving the atom order within each residue
+    order = order[np.argsort(comp_ids[order], kind="stable")]
+    comp_ids, atom_names, elements = (
+        comp_ids[order],
+        atom_names[order],
+        elements[order],
+    )
+    unique_comp_ids, comp_starts = np.unique(comp_ids, return_index=True)
+    comp_slices = {
+        comp_id: slice(start, end)
+        for comp_id, start, end in zip(
+            unique_comp_ids, comp_starts, np.append(comp_starts[1:], len(comp_ids))
+        )
+    }
+    empty = slice(0, 0)  # residues whose atoms were all filtered out
+    res_atom_names = {
+        name: atom_names[comp_slices.get(name, empty)].tolist() for name in res_names
+    }
+    res_elements = {
+        name: elements[comp_slices.get(name, empty)].tolist() for name in res_names
+    }
+    return res_atom_names, res_elements
+
+
 def get_res_categories(res_name: np.ndarray):
-    unique_resnames = np.unique(res_name)
-    unique_restype_indices = map_categories_to_indices(res_name, list(unique_resnames))
-    unique_categories = np.array(
-        [CHEM_COMPONENT_CATEGORIES[resname] for resname in unique_resnames]
+    res_name = np.asarray(res_name)
+    indices, found = lookup_category_indices(
+        res_name, _SORTED_COMPONENT_NAMES, _COMPONENT_NAMES_ORDER
     )
-    return unique_categories[unique_restype_indices]
+    if not np.all(found):
+        raise KeyError(f"Unknown residue names: {np.unique(res_name[~found])}")
+    return _COMPONENT_CATEGORIES_ARRAY[indices]
 
 
 def get_all_residue_names(category: str):
@@ -152,9 +208,10 @@ def get_all_residue_names(category: str):
         "small_molecule",
         "carbohydrate",
     ], f"Unsupported molecule category {category}"
-    return sorted(
-        res for res, cat in CHEM_COMPONENT_CATEGORIES.items() if cat == category
-    )
+    # n.b. _SORTED_COMPONENT_NAMES is sorted, so the selection is too
+    return _SORTED_COMPONENT_NAMES[
+        _COMPONENT_CATEGORIES_ARRAY[_COMPONENT_NAMES_ORDER] == category
+    ].tolist()
 
 
 # TODO: support inferring chirality from residue name
@@ -209,7 +266,31 @@ class ResidueDictionary:
                 conversion["element_swaps"] = [
                     tuple(swaps) for swaps in conversion["element_swaps"]
                 ]
+        # n.b. lookup tables are cached, so dictionaries shouldn't be modified after init
         self._expected_relative_atom_indices_mapping = None
+        self._relative_atom_indices_by_residue = {}
+        self._standard_atoms_by_residue = None
+        self._standard_elements_by_residue = None
+        # flat (concatenated) residue_atoms / residue_elements, built on first use
+        self._flat_residue_lists = {}
+        self._atom_type_positions = {
+            atom_type: ix for ix, atom_type in enumerate(self.atom_types)
+        }
+        self._residue_sizes = np.array(
+            [len(self.residue_atoms[resname]) for resname in self.residue_names]
+        )
+        # array versions of the name/letter lists, for vectorised indexing
+        self._residue_names_array = np.array(self.residue_names)
+        self._residue_letters_array = np.array(self.residue_letters)
+        self._atom_types_array = np.array(self.atom_types)
+        self._element_types_array = np.array(self.element_types)
+        # sorted lookup tables for vectorised name -> index mapping
+        self._sorted_categories = {
+            "res_name": sort_categories(self.residue_names),
+            "res_letter": sort_categories(self.residue_letters),
+            "atom_name": sort_categories(self.atom_types),
+            "element": sort_categories(self.element_types),
+        }
 
     @classmethod
     def from_ccd_dict(
@@ -308,27 +389,34 @@ class ResidueDictionary:
         conversions: Optional[List[Dict]] = None,
         minimum_pdb_entries: int = 1,  # ligands might often be unique - but then what's benefit of residue dictionary for unique ligands? SmallMolecule doens't even use residue dictionary
     ):
-        ccd_data = get_ccd()
         chem_component_3to1 = get_component_3to1()
-        chem_component_categories = get_component_categories(get_component_types())
+        chem_component_categories = CHEM_COMPONENT_CATEGORIES
         frequencies = get_residue_frequencies()
-        res_names = np.unique(ccd_data["chem_comp_atom"]["comp_id"].as_array(str))
+        comp_ids = get_ccd()["chem_comp_atom"]["comp_id"].as_array(str)
+        # atoms are grouped by component, so deduplicating the first id of each run
+        # gives the same names as np.unique(comp_ids) without sorting every atom
+        run_starts = np.flatnonzero(comp_ids[1:] != comp_ids[:-1]) + 1
+        res_names = np.unique(
+            comp_ids[np.append(0, run_starts)] if len(comp_ids) else comp_ids
+        )
 
-        def keep_res(res_name):
-            res_filter = frequencies.get(res_name, 0) >= minimum_pdb_entries
-            res_filter = (
-                res_filter
-                and (residue_names is None or res_name in residue_names)
-                and (
-                    category is None or chem_component_categories[res_name] == category
-                )
-            )
-            res_filter = res_filter and (
-                keep_hydrogens or res_name not in ["H", "D", "D8U"]
+        # select residues with vectorised masks rather than a per-residue filter
+        keep = (
+            np.fromiter(
+                (frequencies.get(res_name, 0) for res_name in res_names.tolist()),
+                dtype=np.int64,
+                count=len(res_names),
             )
-            return res_filter
+            >= minimum_pdb_entries
+        )
+        if residue_names is not None:
+            keep &= np.isin(res_names, list(residue_names))
+        if category is not None:
+            keep[keep] = get_res_categories(res_names[keep]) == category
+        if not keep_hydrogens:
+            keep &= ~np.isin(res_names, ["H", "D", "D8U"])
+        res_names = res_names[keep].tolist()
 
-        res_names = [res for res in res_names if keep_res(res)]
         categories = {chem_component_categories[name] for name in res_names}
         res_letters = [chem_component_3to1[name] for name in res_names]
         res_categories = {name: chem_component_categories[name] for name in res_names}
@@ -337,24 +425,9 @@ class ResidueDictionary:
             backbone_atoms is None or len(categories) == 1
         ), "Backbone atoms only supported for single category dictionaries"
 
-        res_atom_names = {}
-        res_element_types = {}
-        chem_comp_atom = ccd_data["chem_comp_atom"]
-        for name in res_names:
-            res_mask = chem_comp_atom["comp_id"].as_array(str) == name
-            assert np.any(res_mask), f"No atoms found for residue {name}"
-            res_elements_arr = chem_comp_atom["type_symbol"].as_array(str)[res_mask]
-            res_atom_names_arr = chem_comp_atom["atom_id"].as_array(str)[res_mask]
-            assert len(res_elements_arr) == len(res_atom_names_arr)
-
-            mask = np.ones(len(res_atom_names_arr), dtype=bool)
-            if not keep_hydrogens:
-                mask &= (res_elements_arr != "H") & (res_elements_arr != "D")
-            if not keep_oxt:
-                mask &= res_atom_names_arr != "OXT"
-
-            res_atom_names[name] = list(res_atom_names_arr[mask])
-            res_element_types[name] = list(res_elements_arr[mask])
+        res_atom_names, res_element_types = get_ccd_residue_atoms_and_elements(
+            res_names, keep_hydrogens=keep_hydrogens, keep_oxt=keep_oxt
+        )
 
         element_types = sorted(set(itertools.chain(*res_element_types.values())))
         atom_types = sorted(set(itertools.chain(*res_atom_names.values())))
@@ -374,27 +447,42 @@ class ResidueDictionary:
     def __str__(self):
         return f"{self.__class__.__name__} ({len(self.residue_names)}) residue types"
 
+    @property
+    def residue_names_array(self) -> np.ndarray:
+        return self._residue_names_array
+
+    @property
+    def residue_letters_array(self) -> np.ndarray:
+        return self._residue_letters_array
+
+    @property
+    def atom_types_array(self) -> np.ndarray:
+        return self._atom_types_array
+
+    @property
+    def element_types_array(self) -> np.ndarray:
+        return self._element_types_array
+
     @property
     def residue_sizes(self):
-        return np.array(
-            [len(self.residue_atoms[resname]) for resname in self.residue_names]
-        )
+        return self._residue_sizes
 
     def get_res_name_relative_atom_indices_mapping(self, res_name: str) -> np.ndarray:
+        if res_name in self._relative_atom_indices_by_residue:
+            return self._relative_atom_indices_by_residue[res_name]
         if res_name == self.unknown_residue_name:
             # n.b. in some structures, UNK also contains CB, CG, ...
             residue_atom_list = self.backbone_atoms or []
         else:
             residue_atom_list = self.residue_atoms[res_name]
         atom_indices_mapping = np.full(len(self.atom_types), -100, dtype=int)
-        atom_in_res_mask = np.isin(self.atom_types, residue_atom_list)
-        relative_indices = np.array(
-            [
-                residue_atom_list.index(atom_type)
-                for atom_type in np.array(self.atom_types)[atom_in_res_mask]
-            ]
-        )
-        atom_indices_mapping[atom_in_res_mask] = relative_indices
+        # atoms not in atom_types are skipped; reversed so that the first occurrence wins
+        for relative_index, atom_name in reversed(list(enumerate(residue_atom_list))):
+            if atom_name in self._atom_type_positions:
+                atom_indices_mapping[
+                    self._atom_type_positions[atom_name]
+                ] = relative_index
+        self._relative_atom_indices_by_residue[res_name] = atom_indices_mapping
         return atom_indices_mapping
 
     def relative_atom_indices_mapping(
@@ -404,14 +492,13 @@ class ResidueDictionary:
         Get a mapping from atom type index to expected index relative to the start of a given residue.
         """
         assert self.atom_types is not None
-        all_atom_indices_mapping = []
-        expected_relative_atom_indices_mapping = {}
-
-        for resname in self.residue_names if resnames is None else resnames:
-            res_mapping = self.get_res_name_relative_atom_indices_mapping(resname)
-            expected_relative_atom_indices_mapping[resname] = list(res_mapping)
-            all_atom_indices_mapping.append(res_mapping)
-        return np.stack(all_atom_indices_mapping, axis=0)
+        return np.stack(
+            [
+                self.get_res_name_relative_atom_indices_mapping(resname)
+                for resname in (self.residue_names if resnames is None else resnames)
+            ],
+            axis=0,
+        )
 
     @property
     def max_residue_size(self):
@@ -427,29 +514,81 @@ class ResidueDictionary:
         assert self.element_types is not None
         return len(self.element_types)
 
-    # TODO: would be good to cache but cant cache list arg.
+    def _get_flat_residue_lists(self, attr: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Concatenation of each residue's list in `attr`, and the offset of each residue.
+
+        Per-atom lookups can then index a single flat array, as
+        flat[offsets[restype_index] + relative_atom_index].
+        """
+        if attr not in self._flat_residue_lists:
+            residue_lists = getattr(self, attr)
+            residue_lists = [residue_lists[name] for name in self.residue_names]
+            offsets = np.zeros(len(residue_lists) + 1, dtype=np.int64)
+            np.cumsum([len(res_list) for res_list in residue_lists], out=offsets[1:])
+            flat = np.array(
+                list(itertools.chain.from_iterable(residue_lists)), dtype="U6"
+            )
+            self._flat_residue_lists[attr] = (flat, offsets)
+        return self._flat_residue_lists[attr]
+
+    def _gather_residue_lists(
+        self, attr: str, restype_index: np.ndarray, relative_atom_index: np.ndarray
+    ) -> np.ndarray:
+        """Per-atom lookup into the flat `attr` array.
+
+        As with the padded tables, "" is returned for relative atom indices outside
+        the residue, rather than reading into the neighbouring residue's entries.
+        """
+        flat, offsets = self._get_flat_residue_lists(attr)
+        restype_index = np.asarray(restype_index)
+        relative_atom_index = np.asarray(relative_atom_index)
+        starts = offsets[restype_index]
+        in_residue = (relative_atom_index >= 0) & (
+            relative_atom_index < offsets[restype_index + 1] - starts
+        )
+        values = np.full(in_residue.shape, "", dtype=flat.dtype)
+        values[in_residue] = flat[(starts + relative_atom_index)[in_residue]]
+        return values
+
+    def _pad_residue_lists(self, attr: str, restype_indices: np.ndarray) -> np.ndarray:
+        flat, offsets = self._get_flat_residue_lists(attr)
+        starts = offsets[restype_indices]
+        sizes = offsets[restype_indices + 1] - starts
+        positions = np.arange(self.max_residue_size)
+        mask = positions < sizes[:, None]
+        arr = np.full(mask.shape, "", dtype="U6")
+        arr[mask] = flat[(starts[:, None] + positions)[mask]]
+        return arr
+
     def standard_atoms_by_residue(self, resnames: Optional[List[str]] = None):
         """Return a fixed size array of atom names for each residue type.
 
         Shape (num_residue_types x max_atoms_per_residue)
         e.g. for proteins we use atom14 (21 x 14)
 
-        N.B.This function remains a bit of a bottleneck.
+        The full array (resnames=None) is cached; for large dictionaries pass
+        the subset of residue names that are needed instead.
         """
-        resnames = resnames or self.residue_names
-        arr = np.full((len(resnames), self.max_residue_size), "", dtype="U6")
-        for ix, residue_name in enumerate(resnames):
-            residue_atoms = self.residue_atoms[residue_name]
-            arr[ix, : len(residue_atoms)] = residue_atoms
-        return arr
+        if resnames:
+            return self._pad_residue_lists(
+                "residue_atoms", self.res_name_to_index(resnames)
+            )
+        if self._standard_atoms_by_residue is None:
+            self._standard_atoms_by_residue = self._pad_residue_lists(
+                "residue_atoms", np.arange(len(self.residue_names))
+            )
+        return self._standard_atoms_by_residue
 
     def standard_elements_by_residue(self, resnames: Optional[List[str]] = None):
-        resnames = resnames or self.residue_names
-        arr = np.full((len(resnames), self.max_residue_size), "", dtype="U6")
-        for ix, residue_name in enumerate(resnames):
-            residue_elements = self.residue_elements[residue_name]
-            arr[ix, : len(residue_elements)] = residue_elements
-        return arr
+        if resnames:
+            return self._pad_residue_lists(
+                "residue_elements", self.res_name_to_index(resnames)
+            )
+        if self._standard_elements_by_residue is None:
+            self._standard_elements_by_residue = self._pad_residue_lists(
+                "residue_elements", np.arange(len(self.residue_names))
+            )
+        return self._standard_elements_by_residue
 
     def get_residue_sizes(
         self, restype_index: np.ndarray, chain_id: np.ndarray
@@ -458,7 +597,7 @@ class ResidueDictionary:
 
     def get_residue_categories(self, restype_index: np.ndarray) -> np.ndarray:
         restype_indices = np.unique(restype_index)
-        resnames = np.array(self.residue_names)[restype_indices]
+        resnames = self.residue_names_array[restype_indices]
         assert self.residue_categories is not None
         cat_arr = np.array([self.residue_categories[resname] for resname in resnames])
         subset_restype_indices = np.searchsorted(restype_indices, restype_index)
@@ -468,21 +607,25 @@ class ResidueDictionary:
         if len(self.residue_names) > 100:
             # for large dictionaries, only compute atom indices for subset of residues
             restype_indices = np.unique(restype_index)
-            resnames = np.array(self.residue_names)[restype_indices]
+            resnames = self.residue_names_array[restype_indices]
             # index relative to restype_indices of restype_index
             subset_restype_indices = np.searchsorted(restype_indices, restype_index)
-            mapping = self.relative_atom_indices_mapping(resnames)[
-                subset_restype_indices, atomtype_index
-            ]
+            mapping = gather_2d(
+                self.relative_atom_indices_mapping(resnames),
+                subset_restype_indices,
+                atomtype_index,
+            )
         else:
             # for small dictionaries, just compute and cache the full mapping
             if self._expected_relative_atom_indices_mapping is None:
                 self._expected_relative_atom_indices_mapping = (
                     self.relative_atom_indices_mapping()
                 )
-            mapping = self._expected_relative_atom_indices_mapping[
-                restype_index, atomtype_index
-            ]
+            mapping = gather_2d(
+                self._expected_relative_atom_indices_mapping,
+                restype_index,
+                atomtype_index,
+            )
         return mapping
 
     def get_atom_names(
@@ -492,14 +635,9 @@ class ResidueDictionary:
         chain_id: np.ndarray,
     ):
         # chain_id is used by ProteinDictionary -- TODO: maybe just accept atoms directly
-        restype_indices = np.unique(restype_index)
-        resnames = list(np.array(self.residue_names)[restype_indices])
-        # index relative to restype_indices of restype_index
-        subset_restype_indices = np.searchsorted(restype_indices, restype_index)
-        return self.standard_atoms_by_residue(resnames)[
-            subset_restype_indices,
-            relative_atom_index,
-        ]
+        return self._gather_residue_lists(
+            "residue_atoms", restype_index, relative_atom_index
+        )
 
     def get_elements(
         self,
@@ -507,62 +645,85 @@ class ResidueDictionary:
         relative_atom_index: np.ndarray,
         chain_id: np.ndarray,
     ):
-        restype_indices = np.unique(restype_index)
-        resnames = list(np.array(self.residue_names)[restype_indices])
-        # index relative to restype_indices of restype_index
-        subset_restype_indices = np.searchsorted(restype_indices, restype_index)
-        return self.standard_elements_by_residue(resnames)[
-            subset_restype_indices,
-            relative_atom_index,
-        ]
+        return self._gather_residue_lists(
+            "residue_elements", restype_index, relative_atom_index
+        )
 
-    def res_name_to_index(self, res_name: np.ndarray) -> np.ndarray:
-        # n.b. protein resnames are sorted in alphabetical order, apart from UNK
-        if not np.all(np.isin(res_name, np.array(self.residue_names))):
+    def _categories_to_indices(self, values: np.ndarray, attr: str) -> np.ndarray:
+        values = np.asarray(values)
+        indices, found = lookup_category_indices(values, *self._sorted_categories[attr])
+        if not np.all(found):
             raise ValueError(
-                f"res_name contains elements not in the allowed list: "
-                f"{np.unique(res_name[~np.isin(res_name, np.array(self.residue_names))])}"
+                f"{attr} contains elements not in the allowed list: "
+                f"{np.unique(values[~found])}"
             )
-        return map_categories_to_indices(res_name, self.residue_names)
+        return indices
+
+    def res_name_to_index(self, res_name: np.ndarray) -> np.ndarray:
+        # n.b. protein resnames are sorted in alphabetical order, apart from UNK
+        return self._categories_to_indices(res_name, "res_name")
+
+    def res_name_in_dictionary(self, res_name: np.ndarray) -> np.ndarray:
+        """Mask of the res_name values that are in the dictionary."""
+        _, found = lookup_category_indices(
+            np.asarray(res_name), *self._sorted_categories["res_name"]
+        )
+        return found
 
     def res_letter_to_index(self, res_letter: np.ndarray) -> np.ndarray:
-        if not np.all(np.isin(res_letter, np.array(self.residue_letters))):
-            raise ValueError(
-                f"res_letter contains elements not in the allowed list: "
-                f"{np.unique(res_letter[~np.isin(res_letter, np.array(self.residue_letters))])}"
-            )
-        return map_categories_to_indices(res_letter, self.residue_letters)
+        return self._categories_to_indices(res_letter, "res_letter")
+
+    def atom_name_to_index(self, atom_name: np.ndarray) -> np.ndarray:
+        return self._categories_to_indices(atom_name, "atom_name")
+
+    def element_to_index(self, element: np.ndarray) -> np.ndarray:
+        return self._categories_to_indices(element, "element")
 
     def atomtype_index_full_to_short(self):
         # return a num_residues, num_full, num_short mapping array (e.g. atom37 -> atom14 for each residue)
         raise NotImplementedError()
 
     def res_name_to_onehot(self, res_name: np.ndarray) -> np.ndarray:
-        masks = [res_name == r for r in self.residue_names]
-        return np.stack(masks, axis=-1)
+        # unknown residue names have all-zero rows
+        res_name = np.asarray(res_name)
+        indices, found = lookup_category_indices(
+            res_name, *self._sorted_categories["res_name"]
+        )
+        onehot = np.zeros(res_name.shape + (len(self.residue_names),), dtype=bool)
+        np.put_along_axis(onehot, indices[..., None], found[..., None], axis=-1)
+        return onehot
 
     def res_letter_to_onehot(self, res_letter: np.ndarray) -> np.ndarray:
-        masks = [res_letter == r for r in self.residue_letters]
-        return np.stack(masks, axis=-1)
+        # n.b. letters can be shared by several residue types, so this is a broadcast
+        # comparison rather than an index lookup
+        return np.asarray(res_letter)[..., None] == self.residue_letters_array
 
     def res_letter_to_name(self, res_letter: np.ndarray) -> np.ndarray:
-        return np.array(self.residue_names)[self.res_letter_to_index(res_letter)]
+        return self.residue_names_array[self.res_letter_to_index(res_letter)]
 
     def decode_restype_index(self, restype_index: np.ndarray) -> np.ndarray:
-        return "".join(np.array(self.residue_letters)[restype_index])
+        return "".join(self.residue_letters_array[restype_index])
 
     def atom_full_to_atom_short(self):
         # eg atom37->atom14
         raise NotImplementedError()
 
 
+@functools.lru_cache(maxsize=None)
+def get_default_ccd_residue_dictionary() -> ResidueDictionary:
+    """Shared ResidueDictionary.from_ccd_dict(), built once per process.
+
+    Used as the fallback when no residue dictionary is provided; treat as read-only.
+    """
+    return ResidueDictionary.from_ccd_dict()
+
+
 def tile_residue_annotation_to_atoms(
     atoms: bs.AtomArray, residue_annotation: np.ndarray, residue_starts: np.ndarray
 ) -> np.ndarray:
-    # use residue index as cumsum of residue starts
     assert len(residue_annotation) == len(residue_starts)
-    residue_index = np.cumsum(get_residue_starts_mask(atoms, residue_starts)) - 1
-    return residue_annotation[residue_index]
+    # repeat each residue's value by the residue size, without building a per-atom index
+    return np.repeat(residue_annotation, np.diff(residue_starts, append=len(atoms)))
 
 
 def get_residue_starts_mask(
@@ -575,6 +736,63 @@ def get_residue_starts_mask(
     return mask
 
 
+def _residue_index_numpy(residue_starts: np.ndarray, num_atoms: int) -> np.ndarray:
+    residue_sizes = np.diff(residue_starts, append=num_atoms)
+    return np.repeat(np.arange(len(residue_starts)), residue_sizes)
+
+
+if bio_config.NUMBA_AVAILABLE:
+
+    @numba.njit(cache=True)
+    def _residue_index_numba(residue_starts: np.ndarray, num_atoms: int) -> np.ndarray:
+        # single pass, incrementing the residue index at each residue start
+        residue_index = np.empty(num_atoms, dtype=np.int64)
+        res_ix = -1
+        next_start = 0
+        for atom_ix in range(num_atoms):
+            while (
+                next_start < len(residue_starts)
+                and residue_starts[next_start] == atom_ix
+            ):
+                res_ix += 1
+                next_start += 1
+            residue_index[atom_ix] = res_ix
+        return residue_index
+
+
+def get_residue_index(residue_starts: np.ndarray, num_atoms: int) -> np.ndarray:
+    """Index of the residue each atom belongs to (residue_starts must begin at 0)."""
+    if bio_config.NUMBA_AVAILABLE:
+        return _residue_index_numba(np.asarray(residue_starts), num_atoms)
+    return _residue_index_numpy(residue_starts, num_atoms)
+
+
+if bio_config.NUMBA_AVAILABLE:
+
+    @numba.njit(cache=True)
+    def _gather_2d_numba(
+        table: np.ndarray, row_index: np.ndarray, col_index: np.ndarray
+    ) -> np.ndarray:
+        out = np.empty(len(row_index), dtype=table.dtype)
+        for i in range(len(row_index)):
+            out[i] = table[row_index[i], col_index[i]]
+        return out
+
+
+def gather_2d(
+    table: np.ndarray, row_index: np.ndarray, col_index: np.ndarray
+) -> np.ndarray:
+    """Equivalent to table[row_index, col_index] for 1d integer index arrays."""
+    if bio_config.NUMBA_AVAILABLE and table.dtype.kind in "biuf":
+        # numba doesn't handle string tables, so these fall back to fancy indexing
+        return _gather_2d_numba(
+            table,
+            np.asarray(row_index, dtype=np.int64),
+            np.asarray(col_index, dtype=np.int64),
+        )
+    return table[row_index, col_index]
+
+
 def _create_complete_atom_array_from_restype_index(
     restype_index: np.ndarray,
     residue_dictionary: ResidueDictionary,
@@ -660,9 +878,7 @@ def create_single_chain_atom_array_from_restype_index(
     full_annot_names = [
         "chain_id",
     ]
-    residue_index = (
-        np.cumsum(get_residue_starts_mask(new_atom_array, residue_starts)) - 1
-    )
+    residue_index = get_residue_index(residue_starts, len(new_atom_array))
     relative_atom_index = np.arange(len(new_atom_array)) - residue_starts[residue_index]
     atom_names = new_atom_array.atom_name
     new_atom_array.set_annotation("restype_index", restype_index[residue_index])
@@ -672,7 +888,7 @@ def create_single_chain_atom_array_from_restype_index(
     new_atom_array.set_annotation("atom_name", atom_names)
     new_atom_array.set_annotation(
         "res_name",
-        np.array(residue_dictionary.residue_names)[new_atom_array.restype_index],
+        residue_dictionary.residue_names_array[new_atom_array.restype_index],
     )
     new_atom_array.set_annotation("hetero", np.zeros(len(new_atom_array), dtype=bool))
     new_atom_array.set_annotation("res_index", residue_index + residue_index_offset)
@@ -687,9 +903,7 @@ def create_single_chain_atom_array_from_restype_index(
     new_atom_array.set_annotation("element", elements)
     new_atom_array.set_annotation(
         "elemtype_index",
-        map_categories_to_indices(
-            new_atom_array.element, residue_dictionary.element_types
-        ),
+        residue_dictionary.element_to_index(new_atom_array.element),
     )
     full_annot_names += [
         "atom_name",
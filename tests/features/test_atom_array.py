@@ -1,8 +1,20 @@
+import os
+
 import numpy as np
 import pytest
+from biotite.structure import get_residue_starts
+from biotite.structure.io.pdb import PDBFile
 from biotite.structure.sequence import to_sequence
 
-from bio_datasets.features.atom_array import AtomArrayFeature, ProteinAtomArrayFeature
+from bio_datasets import Dataset, Features
+from bio_datasets.features.atom_array import (
+    AtomArrayFeature,
+    ProteinAtomArrayFeature,
+    ProteinStructureFeature,
+    StructureFeature,
+    protein_atom_array_from_dict,
+)
+from bio_datasets.structure.parsing import cif_to_bcif, load_structure
 from bio_datasets.structure.protein import ProteinDictionary
 
 
@@ -48,3 +60,208 @@ def test_encode_decode_atom_array_without_residue_dictionary(afdb_atom_array):
     assert np.all(decoded.chain_id == afdb_atom_array.chain_id)
     assert decoded.element[-1] == "O"
     assert decoded.atom_name[-1] == "OXT"
+
+
+def test_afdb_preset_quantizes_plddt():
+    """pLDDT b-factors are stored per-residue as uint8 and decoded to float32."""
+    atoms = PDBFile.read(
+        os.path.join(os.path.dirname(__file__), "..", "AF-V9HVX0-F1-model_v4.pdb")
+    ).get_structure(model=1, extra_fields=["b_factor"])
+    feat = ProteinAtomArrayFeature.from_preset("afdb", load_as="biotite")
+    encoded = feat.encode_example(atoms)
+    assert encoded["b_factor"].dtype == np.uint8
+    res_starts = get_residue_starts(atoms)
+    assert np.abs(encoded["b_factor"] - atoms.b_factor[res_starts]).max() <= 0.5
+    decoded = feat.decode_example(encoded)
+    assert decoded.b_factor.dtype == np.float32
+
+
+def test_protein_atom_array_from_backbone_dict(afdb_atom_array):
+    backbone = afdb_atom_array[
+        np.isin(afdb_atom_array.atom_name, ["N", "CA", "C", "O"])
+    ]
+    sequence = str(to_sequence(backbone)[0][0])
+    d = {
+        "sequence": sequence,
+        "backbone_coords": {
+            atom_name: backbone.coord[backbone.atom_name == atom_name]
+            for atom_name in ["N", "CA", "C", "O"]
+        },
+    }
+    atoms = protein_atom_array_from_dict(d)
+    assert len(atoms) == len(backbone)
+    assert np.all(atoms.atom_name == backbone.atom_name)
+    assert np.all(atoms.res_name == backbone.res_name)
+    assert np.all(atoms.element == backbone.element)
+    assert np.allclose(atoms.coord, backbone.coord)
+
+
+def test_cast_storage_fills_missing_fields(afdb_atom_array):
+    ds = Dataset.from_list(
+        [{"structure": afdb_atom_array}],
+        features=Features(structure=AtomArrayFeature(load_as="biotite")),
+    )
+    storage = ds.data.column("structure").combine_chunks()
+    feature = AtomArrayFeature(with_b_factor=True, load_as="biotite")
+    cast = feature.cast_storage(storage)
+    assert cast.type.get_field_index("b_factor") >= 0
+    assert cast.field("b_factor").null_count == len(cast)
+    # storage that already has the feature's type is returned as is
+    assert feature.cast_storage(cast) is cast
+
+
+@pytest.mark.parametrize("as_bytes", [False, True])
+def test_encode_atom_array_from_pdb_file(pdb_atoms_top7, as_bytes):
+    path = os.path.join(os.path.dirname(__file__), "..", "1qys.pdb")
+    feature = AtomArrayFeature(load_as="biotite")
+    if as_bytes:
+        with open(path, "rb") as f:
+            value = f.read()
+    else:
+        value = path
+    encoded = feature.encode_example(value)
+    expected = feature.encode_example(pdb_atoms_top7)
+    assert encoded.keys() == expected.keys()
+    for key in expected:
+        assert np.array_equal(encoded[key], expected[key])
+
+
+@pytest.mark.parametrize("all_atoms_present", [False, True])
+def test_encode_atom_types_as_indices(afdb_atom_array, all_atoms_present):
+    residue_dictionary = ProteinDictionary.from_preset("protein", keep_oxt=True)
+    kwargs = {
+        "residue_dictionary": residue_dictionary,
+        "all_atoms_present": all_atoms_present,
+        "load_as": "biotite",
+    }
+    string_feature = AtomArrayFeature(**kwargs)
+    index_feature = AtomArrayFeature(encode_atom_types=True, **kwargs)
+    encoded = index_feature.encode_example(afdb_atom_array)
+    assert "atom_name" not in encoded and "element" not in encoded
+    assert "elemtype_index" in encoded
+    decoded = index_feature.decode_example(encoded)
+    expected = string_feature.decode_example(
+        string_feature.encode_example(afdb_atom_array)
+    )
+    assert np.all(decoded.atom_name == expected.atom_name)
+    assert np.all(decoded.element == expected.element)
+
+
+@pytest.mark.parametrize("with_coords_offset", [False, True])
+def test_float16_coords_round_trip(afdb_atom_array, with_coords_offset):
+    atoms = afdb_atom_array.copy()
+    atoms.coord += 500  # far from the origin, where float16 spacing is 0.25A
+    feat = AtomArrayFeature(
+        coords_dtype="float16", with_coords_offset=with_coords_offset
+    )
+    ds = Dataset.from_list([{"structure": atoms}], features=Features(structure=feat))
+    decoded = ds[0]["structure"]
+    assert decoded.coord.dtype == np.float32
+    max_error = np.abs(decoded.coord - atoms.coord).max()
+    if with_coords_offset:
+        assert max_error < 0.05
+    else:
+        assert max_error > 0.05
+
+
+@pytest.mark.parametrize("encode_atom_types", [False, True])
+def test_encode_batch_matches_encode_example(afdb_atom_array, encode_atom_types):
+    feat = AtomArrayFeature(
+        residue_dictionary=ProteinDictionary.from_preset("protein", keep_oxt=True),
+        encode_atom_types=encode_atom_types,
+    )
+    atom_arrays = [afdb_atom_array, afdb_atom_array[afdb_atom_array.res_id < 10]]
+    for batch_encoded, atoms in zip(feat.encode_batch(atom_arrays), atom_arrays):
+        encoded = feat.encode_example(atoms)
+        assert batch_encoded.keys() == encoded.keys()
+        for key, value in encoded.items():
+            assert np.array_equal(batch_encoded[key], value)
+
+
+@pytest.mark.parametrize(
+    "feature",
+    [
+        ProteinStructureFeature(load_as="biotite"),
+        ProteinAtomArrayFeature(load_as="biotite"),
+    ],
+)
+def test_protein_features_from_list_match_encode_example(cif_file_1aq1, feature):
+    atoms = load_structure(cif_file_1aq1)
+    ds = Dataset.from_list([{"structure": atoms}], features=Features(structure=feature))
+    stored = ds.with_format("arrow")[0]["structure"].to_pylist()[0]
+    encoded = feature.encode_example(atoms)
+    assert stored.keys() == encoded.keys()
+    for key, value in encoded.items():
+        assert np.array_equal(np.asarray(stored[key]), np.asarray(value))
+    decoded = ds[0]["structure"]
+    assert not np.any(np.isin(decoded.res_name, ["HOH", "STU"]))
+
+
+@pytest.mark.parametrize(
+    "feature",
+    [StructureFeature(load_as="biotite"), AtomArrayFeature(load_as="biotite")],
+)
+def test_bcif_bytes_round_trip(cif_file_1aq1, feature):
+    with open(cif_file_1aq1, "rb") as f:
+        structure = {
+            "bytes": cif_to_bcif(f.read()),
+            "path": "1aq1.bcif",
+            "type": "bcif",
+        }
+    ds = Dataset.from_list(
+        [{"structure": structure}], features=Features(structure=feature)
+    )
+    decoded = ds[0]["structure"]
+    expected = load_structure(cif_file_1aq1)
+    assert np.array_equal(decoded.res_name, expected.res_name)
+    assert np.allclose(decoded.coord, expected.coord, atol=1e-3)
+
+
+def test_decode_b_factor_from_lists_or_none(afdb_atom_array):
+    feat = AtomArrayFeature(with_b_factor=True, load_as="biotite")
+    atoms = afdb_atom_array.copy()
+    atoms.set_annotation("b_factor", np.linspace(0, 100, len(atoms)))
+    ds = Dataset.from_list([{"structure": atoms}], features=Features(structure=feat))
+    # without numpy formatting, the stored b_factor comes back as a python list
+    decoded = ds.with_format(None)[0]["structure"]
+    assert decoded.b_factor.dtype == np.float32
+    assert np.allclose(decoded.b_factor, atoms.b_factor, atol=1e-3)
+    encoded = feat.encode_example(atoms)
+    encoded["b_factor"] = None
+    assert "b_factor" not in feat.decode_example(encoded).get_annotation_categories()
+
+
+def test_afdb_preset_round_trip_without_numpy_format():
+    """The afdb preset (uint8 pLDDT, float16 coords with offset) decodes from lists."""
+    atoms = PDBFile.read(
+        os.path.join(os.path.dirname(__file__), "..", "AF-V9HVX0-F1-model_v4.pdb")
+    ).get_structure(model=1, extra_fields=["b_factor"])
+    feat = ProteinAtomArrayFeature.from_preset("afdb", load_as="biotite")
+    encoded = feat.encode_example(atoms)
+    # all_atoms_present reorders atoms, so compare against decoding the ndarray encoding
+    expected = feat.decode_example(dict(encoded))
+    ds = Dataset.from_list([{"structure": atoms}], features=Features(structure=feat))
+    # the quantized b_factor and offset coords may come back as python lists
+    as_lists = {
+        **encoded,
+        **{
+            key: np.asarray(encoded[key]).tolist()
+            for key in ["b_factor", "coords", "coords_offset"]
+        },
+    }
+    for decoded in [
+        ds.with_format(None)[0]["structure"],
+        feat.decode_example(as_lists),
+    ]:
+        assert np.array_equal(decoded.atom_name, expected.atom_name)
+        assert np.array_equal(decoded.coord, expected.coord)
+        assert decoded.b_factor.dtype == np.float32
+        assert np.array_equal(decoded.b_factor, expected.b_factor)
+    res_starts = get_residue_starts(atoms)
+    decoded_res_starts = get_residue_starts(expected)
+    assert (
+        np.abs(expected.b_factor[decoded_res_starts] - atoms.b_factor[res_starts]).max()
+        <= 0.5
+    )
+    decoded = feat.decode_example({**encoded, "b_factor": None})
+    assert "b_factor" not in decoded.get_annotation_categories()
@@ -1,6 +1,10 @@
 import numpy as np
 
-from bio_datasets.np_utils import map_categories_to_indices
+from bio_datasets.np_utils import (
+    lookup_category_indices,
+    map_categories_to_indices,
+    sort_categories,
+)
 
 
 def test_map_categories_to_indices():
@@ -9,3 +13,11 @@ def test_map_categories_to_indices():
     assert np.all(
         map_categories_to_indices(arr, categories) == np.array([0, 1, 2, 1, 2, 0])
     )
+
+
+def test_lookup_category_indices():
+    categories = ["C", "A", "B", "A"]
+    arr = np.array(["A", "B", "C", "D", "0"])
+    indices, found = lookup_category_indices(arr, *sort_categories(categories))
+    assert np.all(found == np.array([True, True, True, False, False]))
+    assert np.all(indices[found] == map_categories_to_indices(arr[:3], categories))
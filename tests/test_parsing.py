@@ -0,0 +1,72 @@
+import io
+
+import numpy as np
+import pytest
+from biotite.structure.io import pdbx
+
+from bio_datasets.structure.parsing import (
+    _into_fitting_type,
+    cif_to_bcif,
+    load_structure,
+)
+
+
+def test_cif_to_bcif_round_trip(cif_file_1aq1):
+    with open(cif_file_1aq1, "rb") as f:
+        bcif_bytes = cif_to_bcif(f.read())
+    atoms = load_structure(io.BytesIO(bcif_bytes), file_type="bcif")
+    expected = load_structure(cif_file_1aq1)
+    assert len(atoms) == len(expected)
+    assert np.allclose(atoms.coord, expected.coord)
+    for annot in ["chain_id", "res_id", "res_name", "atom_name", "element"]:
+        assert np.array_equal(
+            atoms.get_annotation(annot), expected.get_annotation(annot)
+        )
+
+
+@pytest.mark.parametrize(
+    "strings,expected_kind",
+    [
+        (["1_555", "2_555"], "U"),  # symmetry operators
+        (["004", "12"], "U"),  # zero-padded ids
+        (["1E5", "2"], "U"),
+        (["1", "-3", "10"], "i"),
+        (["10.100", "-0.500", "3.0"], "f"),
+    ],
+)
+def test_into_fitting_type_is_lossless(strings, expected_kind):
+    array = _into_fitting_type(np.array(strings), None)
+    assert array.dtype.kind == expected_kind
+    if expected_kind == "U":
+        assert array.tolist() == strings
+    else:
+        assert np.array_equal(array, np.array(strings).astype(float))
+
+
+def test_cif_to_bcif_keeps_symmetry_operators(cif_file_1aq1):
+    with open(cif_file_1aq1, "rb") as f:
+        bcif_file = pdbx.BinaryCIFFile.read(io.BytesIO(cif_to_bcif(f.read())))
+    oper_list = bcif_file.block["pdbx_struct_oper_list"]
+    assert oper_list["name"].as_array(str).tolist() == ["1_555"]
+
+
+def test_cif_to_bcif_preserves_all_columns(cif_file_1aq1):
+    with open(cif_file_1aq1, "rb") as f:
+        cif_bytes = f.read()
+    cif_file = pdbx.CIFFile.read(io.StringIO(cif_bytes.decode()))
+    bcif_file = pdbx.BinaryCIFFile.read(io.BytesIO(cif_to_bcif(cif_bytes)))
+    for category_name, category in cif_file.block.items():
+        bcif_category = bcif_file.block[category_name]
+        for column_name, column in category.items():
+            expected = column.as_array(str)
+            bcif_column = bcif_category[column_name]
+            if bcif_column.data.array.dtype.kind == "f":
+                # fixed-point strings only differ in trailing zeros
+                assert np.allclose(
+                    bcif_column.as_array(float), column.as_array(float)
+                ), (category_name, column_name)
+            else:
+                assert np.array_equal(bcif_column.as_array(str), expected), (
+                    category_name,
+                    column_name,
+                )
@@ -0,0 +1,27 @@
+import numpy as np
+
+from bio_datasets.structure.residue import ResidueDictionary
+
+
+def test_atom_lookups_past_residue_end_are_empty():
+    residue_dictionary = ResidueDictionary(
+        residue_names=["GLY", "ALA"],
+        residue_letters=["G", "A"],
+        residue_atoms={"GLY": ["N", "CA"], "ALA": ["N", "CA", "CB"]},
+        residue_elements={"GLY": ["N", "C"], "ALA": ["N", "C", "C"]},
+        unknown_residue_name="UNK",
+        atom_types=["N", "CA", "CB"],
+        element_types=["N", "C"],
+    )
+    restype_index = np.array([0, 0, 0, 1, 1])
+    # index 2 is past the end of GLY, so must not read ALA's first atom
+    relative_atom_index = np.array([0, 1, 2, 2, 3])
+    chain_id = np.full(5, "A")
+    atom_names = residue_dictionary.get_atom_names(
+        restype_index, relative_atom_index, chain_id
+    )
+    elements = residue_dictionary.get_elements(
+        restype_index, relative_atom_index, chain_id
+    )
+    assert atom_names.tolist() == ["N", "CA", "", "CB", ""]
+    assert elements.tolist() == ["N", "C", "", "C", ""]
@@ -0,0 +1,79 @@
+import importlib.util
+import os
+import struct
+
+import pytest
+
+from bio_datasets import Dataset, Features, Value
+from bio_datasets.features import ProteinStructureFeature
+
+foldcomp = pytest.importorskip("foldcomp")
+
+TEST_DIR = os.path.dirname(__file__)
+PDB_FILES = ["AF-V9HVX0-F1-model_v4.pdb", "AF-Q9R172-F1-model_v4.pdb"]
+
+
+def _load_example_module():
+    spec = importlib.util.spec_from_file_location(
+        "upload_foldcomp_db",
+        os.path.join(TEST_DIR, "..", "examples", "upload_foldcomp_db.py"),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def foldcomp_db(tmp_path):
+    """Write a two-entry foldcomp db (mmseqs-style data/index/lookup files)."""
+    db_file = str(tmp_path / "db")
+    data, index, lookup = b"", [], []
+    for key, pdb_file in enumerate(PDB_FILES):
+        name = pdb_file.split(".")[0]
+        with open(os.path.join(TEST_DIR, pdb_file)) as f:
+            record = foldcomp.compress(name, f.read()) + b"\x00"
+        index.append(f"{key}\t{len(data)}\t{len(record)}\n")
+        lookup.append(f"{key}\t{name}\t0\n")
+        data += record
+    with open(db_file, "wb") as f:
+        f.write(data)
+    with open(db_file + ".index", "w") as f:
+        f.writelines(index)
+    with open(db_file + ".lookup", "w") as f:
+        f.writelines(lookup)
+    with open(db_file + ".dbtype", "wb") as f:
+        f.write(struct.pack("<i", 0))
+    return db_file
+
+
+@pytest.mark.parametrize("as_array", [False, True])
+def test_examples_generator(foldcomp_db, as_array):
+    upload_foldcomp_db = _load_example_module()
+    names = upload_foldcomp_db.read_db_names(foldcomp_db)
+    assert names == [pdb_file.split(".")[0] for pdb_file in PDB_FILES]
+    # reversed, to check that examples follow the order of the requested names
+    examples = list(
+        upload_foldcomp_db.examples_generator(foldcomp_db, names[::-1], as_array)
+    )
+    assert [example["name"] for example in examples][::-1] == names
+    if not as_array:
+        assert all(
+            example["structure"]["bytes"].startswith(b"FCMP") for example in examples
+        )
+
+
+def test_sharded_generator(foldcomp_db, tmp_path):
+    upload_foldcomp_db = _load_example_module()
+    names = upload_foldcomp_db.read_db_names(foldcomp_db)
+    ds = Dataset.from_generator(
+        upload_foldcomp_db.examples_generator,
+        gen_kwargs={"db_file": foldcomp_db, "names": names},
+        features=Features(
+            name=Value("string"),
+            structure=ProteinStructureFeature(with_b_factor=True, load_as="biotite"),
+        ),
+        num_proc=2,
+        cache_dir=str(tmp_path / "cache"),
+    )
+    assert ds["name"] == names
+    assert len(ds[0]["structure"]) > 0